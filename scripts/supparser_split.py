@@ -3,11 +3,18 @@
 # script that tries to split a Galaxy tool that covers multiple subparsers
 # into separate tools
 
-import sys
+import copy
 import re
+import sys
 
 import lxml.etree as ET
 
+# Cheetah directives of conditional blocks
+DIRECTIVE_RE = re.compile(r"^( *)#(if|elif|else if|else|end if)\b(.*)$")
+# rest of an #if directive that is closed on the same line, i.e. the inline
+# form "#if $x then '--a' else ''#" or "#if $x# --a #end if#"
+ONE_LINE_IF_RE = re.compile(r"\bthen\b.*\belse\b|#end if\b")
+
 
 def parse_conditional(xml_file):
     # Parse the XML file
@@ -33,10 +40,105 @@ def parse_conditional(xml_file):
     return conditional_name, select_name, option_values
 
 
+def index_command(lines, cond_name, select_name, options):
+    # index of the command lines of every option, computed in one pass with a
+    # stack of the open #if blocks (nested blocks are supported):
+    # - blocks whose branches test the select of the conditional (routing blocks)
+    #   are dropped, their lines only go to the options of the branch, #else
+    #   covers the options that are not tested in the other branches
+    # - all other lines (including other #if blocks) go to all options
+    # returns a dict mapping options to lists of line ranges
+    # [start, end, dedent, in_block] where in_block marks lines of a routing
+    # block that are dedented by the indent of its #if
+    condition_re = re.compile(
+        f"(?:str\\()?\\${re.escape(cond_name)}\\.{re.escape(select_name)}(?:\\))? *== *[\"']([^\"']*)[\"']"
+    )
+    all_options = frozenset(options)
+    index = {option: [] for option in options}
+    # open #if blocks: [routing, indent, options of the current branch, options of all branches so far]
+    stack = []
+    for number, line in enumerate(lines):
+        match = DIRECTIVE_RE.match(line)
+        directive = match.group(2) if match else None
+        if directive == "if" and ONE_LINE_IF_RE.search(match.group(3)):
+            # closed on the same line, no block is opened
+            directive = None
+        if directive is not None:
+            indent = len(match.group(1))
+            condition = condition_re.match(match.group(3).strip())
+            block = stack[-1] if stack else None
+            if directive == "if" and condition:
+                stack.append([True, indent, {condition.group(1)}, {condition.group(1)}])
+                continue
+            if directive in ("elif", "else if") and block and block[0]:
+                if condition:
+                    block[2] = {condition.group(1)}
+                    block[3].add(condition.group(1))
+                else:
+                    print(f"line {number + 1}: can not assign '{line.strip()}' to an option, dropping the branch", file=sys.stderr)
+                    block[2] = set()
+                continue
+            if directive == "else" and block and block[0]:
+                block[2] = all_options - block[3]
+                continue
+            if directive == "end if" and block:
+                stack.pop()
+                if block[0]:
+                    continue
+
+        # the options (and the dedent) of the line are given by the enclosing routing blocks
+        targets = all_options
+        dedent = 0
+        in_block = False
+        for routing, block_indent, current, _ in stack:
+            if routing:
+                targets = targets & current
+                dedent = block_indent
+                in_block = True
+        for option in targets:
+            ranges = index[option]
+            if ranges and ranges[-1][1] == number and ranges[-1][2] == dedent and ranges[-1][3] == in_block:
+                ranges[-1][1] = number + 1
+            else:
+                ranges.append([number, number + 1, dedent, in_block])
+
+        if directive == "if":
+            stack.append([False, indent, None, None])
+    return index
+
+
+def render_command(lines, ranges, cond_name):
+    # command of an option from its line ranges
+    new_command = []
+    for start, end, dedent, in_block in ranges:
+        for line in lines[start:end]:
+            if in_block:
+                line = line[min(dedent, len(line) - len(line.lstrip(" "))):]
+                line = line.replace(f"${cond_name}.", "$")
+            new_command.append(line)
+    return "\n".join(new_command)
+
+
+def split_command(text, cond_name, select_name, options):
+    # split the command into one command per option, the lines are indexed once
+    # and the index is reused for all options
+    lines = text.split("\n")
+    index = index_command(lines, cond_name, select_name, options)
+    return {
+        option: render_command(lines, index[option], cond_name) for option in options
+    }
+
+
 def split(xml_file, cond_name, select_name, options):
 
+    # parse the tool and split its command once, every option gets a copy of the tree
+    template = ET.parse(xml_file)
+    commands = split_command(
+        template.getroot().find("./command").text, cond_name, select_name, options
+    )
+
     for option in options:
-        tree = ET.parse(xml_file)
+        tree = copy.deepcopy(template)
         root = tree.getroot()
 
         # replace conditional with the children of the corresponding when block
@@ -53,36 +155,7 @@ def split(xml_file, cond_name, select_name, options):
 
         # command
         command = root.find("./command")
-        new_command = []
-        if_name = None
-        for line in command.text.split("\n"):
-
-            if_match = re.match(
-                f"^( *)#if (?:str\()?\${cond_name}.{select_name}(?:\))? == [\"'](.*)[\"'].*",
-                line,
-            )
-            if if_match:
-                indent = len(if_match.group(1))
-                if_name = if_match.group(2)
-                continue
-            if if_name is None:
-                new_command.append(line)
-                continue
-            elif_match = re.match(
-                f"^( {{{indent}}})#elif (?:str\()?\${cond_name}.{select_name}(?:\))? == [\"'](.*)[\"'].*",
-                line,
-            )
-            if elif_match:
-                if_name = elif_match.group(2)
-                continue
-            if re.match(f"^( {{{indent}}})#end if", line):
-                if_name = None
-                continue
-
-            if if_name == option:
-                new_command.append(line[indent:].replace(f"${cond_name}.", "$"))
-
-            command.text = ET.CDATA("\n".join(new_command))
+        command.text = ET.CDATA(commands[option])
         # outputs
         outputs = root.find("./outputs")
         for output in outputs.getchildren():
@@ -0,0 +1,62 @@
+import os
+import subprocess
+import sys
+
+import lxml.etree as ET
+
+SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "supparser_split.py")
+
+TOOL = """<tool id="prog" name="prog" version="1">
+    <command><![CDATA[
+prog
+#if $c.s == "a"
+    sub_a
+    #if $c.flag then '--flag' else ''#
+    #if $c.flag# --flag2 #end if#
+#elif $c.s == "b"
+    sub_b
+#end if
+'$output'
+    ]]></command>
+    <inputs>
+        <conditional name="c">
+            <param name="s" type="select">
+                <option value="a">a</option>
+                <option value="b">b</option>
+            </param>
+            <when value="a">
+                <param name="flag" type="boolean"/>
+            </when>
+            <when value="b"/>
+        </conditional>
+    </inputs>
+    <outputs>
+        <data name="output" format="txt"/>
+    </outputs>
+    <tests/>
+</tool>
+"""
+
+
+def split_commands(tmp_path, tool):
+    """
+    Split a tool with the script and return the commands of the new tools by option.
+    """
+    (tmp_path / "tool.xml").write_text(tool)
+    subprocess.run([sys.executable, SCRIPT, "tool.xml"], cwd=tmp_path, check=True)
+    return {
+        option: ET.parse(str(tmp_path / f"{option}.xml")).getroot().find("./command").text.strip().split("\n")
+        for option in ("a", "b")
+    }
+
+
+def test_one_line_if_in_routing_block(tmp_path):
+    commands = split_commands(tmp_path, TOOL)
+    assert commands["a"] == [
+        "prog",
+        "    sub_a",
+        "    #if $flag then '--flag' else ''#",
+        "    #if $flag# --flag2 #end if#",
+        "'$output'",
+    ]
+    assert commands["b"] == ["prog", "    sub_b", "'$output'"]
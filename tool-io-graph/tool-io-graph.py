@@ -1,47 +1,678 @@
+#!/usr/bin/env python
+
+# print the graph of the input and output formats of Galaxy tools in DOT format
+#   python tool-io-graph.py [--processes N] tools/*/*.xml | dot -Tsvg > graph.svg
+
+import argparse
+import copy
+import hashlib
+import json
 import logging
+import multiprocessing
+import os
 import sys
-import xml.etree.ElementTree
+import xml.etree.ElementTree as ET
+from collections import deque
+from xml.sax.saxutils import escape, quoteattr
+
+# number of tool xml files sent to a worker process at once
+CHUNK_SIZE = 64
+# number of bytes fed to the xml parser at once
+BLOCK_SIZE = 16 * 1024
+# parameter types with formats
+DATA_PARAM_TYPES = ("data", "data_collection")
+# output formats of the graph
+OUTPUT_FORMATS = ("dot", "jsonl", "graphml")
+# sections of the tool that are kept for the extraction of the edges
+KEEP_SECTIONS = ("inputs", "outputs", "macros", "expand")
+
+# version of the format of the edge cache file
+CACHE_VERSION = 4
+
+# parsed macro files of this process: path -> (mtime, xml macros, tokens, macro files)
+_macro_cache = {}
+
+
+def load_macro_file(path):
+    """
+    Get the xml macros and tokens defined in a macro file (including its imports).
+
+    Every file is parsed once per process, it is parsed again only if its
+    modification time changed.
+
+    Parameters
+    ----------
+    path: str
+    Path of the macro file
+
+    Returns
+    -------
+    Tuple (dict of xml macros, dict of tokens, set of the paths of the macro
+    file and the files it imports)
+    """
+    mtime = os.path.getmtime(path)
+    cached = _macro_cache.get(path)
+    if cached is not None and cached[0] == mtime:
+        return cached[1:]
+    macros = ET.parse(path).getroot()
+    xml_macros, tokens, files = collect_macros(macros, os.path.dirname(path))
+    files.add(path)
+    _macro_cache[path] = (mtime, xml_macros, tokens, files)
+    return xml_macros, tokens, files
+
+
+def collect_macros(macros, directory):
+    """
+    Get the xml macros and tokens of a macros element, macros of the
+    element itself take precedence over imported ones.
 
-def process_toolxml( toolxml, tools, edges ):
-    e = xml.etree.ElementTree.parse(toolxml).getroot()
-    if e.tag != "tool":
-        logging.warn("%s: seems to be no tool xml file"%toolxml)
+    Parameters
+    ----------
+    macros: Element
+    The macros element of a tool or the root of a macro file
+    directory: str
+    Directory used to resolve imports
+
+    Returns
+    -------
+    Tuple (dict of xml macros, dict of tokens, set of the paths of the
+    imported files including the ones that could not be read)
+    """
+    xml_macros = {}
+    tokens = {}
+    files = set()
+    for child in macros.iterfind("import"):
+        path = os.path.abspath(os.path.join(directory, child.text.strip()))
+        files.add(path)
+        try:
+            imported_xml_macros, imported_tokens, imported_files = load_macro_file(path)
+        except (OSError, ET.ParseError) as e:
+            logging.error("%s: could not import macros: %s" % (path, e))
+            continue
+        xml_macros.update(imported_xml_macros)
+        tokens.update(imported_tokens)
+        files.update(imported_files)
+    for child in macros:
+        if child.tag == "xml":
+            xml_macros[child.attrib["name"]] = child
+        elif child.tag == "token":
+            tokens[child.attrib["name"]] = child.text or ""
+    return xml_macros, tokens, files
+
+
+def replace_tokens(elem, tokens):
+    """
+    Replace tokens in the attributes and texts of elem and its descendants.
+    """
+    if not tokens:
         return
-    idee = e.attrib["id"]
-    
-    tools.add(idee)
-    
-    inputs = e.find("inputs")
-    if inputs == None:
-        logging.error("%s: no inputs found"%toolxml)
+    for e in elem.iter():
+        for key, value in e.attrib.items():
+            if "@" in value:
+                for token, replacement in tokens.items():
+                    value = value.replace(token, replacement)
+                e.attrib[key] = value
+        if e.text and "@" in e.text:
+            for token, replacement in tokens.items():
+                e.text = e.text.replace(token, replacement)
+
+
+def expand_macro(expand, xml_macros):
+    """
+    Get the elements an expand element is replaced by.
+
+    Token parameters of the macro (tokens="name,..." with the defaults
+    token_name="...") and yields are resolved.
+
+    Parameters
+    ----------
+    expand: Element
+    The expand element
+    xml_macros: dict
+    xml macros by name
+
+    Returns
+    -------
+    List of elements
+    """
+    name = expand.attrib.get("macro")
+    if name not in xml_macros:
+        logging.warning("macro %s not found" % name)
+        return []
+    macro = copy.deepcopy(xml_macros[name])
+    parameters = {}
+    for token in macro.attrib.get("tokens", "").split(","):
+        token = token.strip()
+        if token:
+            parameters["@%s@" % token.upper()] = expand.attrib.get(token, macro.attrib.get("token_%s" % token, ""))
+    replace_tokens(macro, parameters)
+    # named yields are filled by token elements of the same name, the others by the remaining children
+    named = {child.attrib.get("name"): list(child) for child in expand if child.tag == "token"}
+    unnamed = [child for child in expand if child.tag != "token"]
+    for parent in list(macro.iter()):
+        i = 0
+        while i < len(parent):
+            if parent[i].tag == "yield":
+                replacement = copy.deepcopy(named.get(parent[i].attrib["name"], []) if "name" in parent[i].attrib else unnamed)
+                parent[i:i + 1] = replacement
+                i += len(replacement)
+            else:
+                i += 1
+    return list(macro)
+
+
+def expand_macros(elem, xml_macros):
+    """
+    Replace all expand elements in the descendants of elem.
+    """
+    i = 0
+    while i < len(elem):
+        child = elem[i]
+        if child.tag == "expand":
+            # expanded elements may contain expand elements again
+            elem[i:i + 1] = expand_macro(child, xml_macros)
+        else:
+            if child.tag != "macros":
+                expand_macros(child, xml_macros)
+            i += 1
+
+
+class ToolGraph:
+    """
+    Index of the graph of formats and tools.
+
+    Adjacency lists are kept by format (the tools consuming and producing
+    it) and by tool id (its input and output formats), so queries do not
+    need to scan all edges.
+    """
+
+    def __init__(self):
+        # format -> set of tool ids with the format as input / output
+        self.consumers = {}
+        self.producers = {}
+        # tool id -> set of input / output formats
+        self.inputs = {}
+        self.outputs = {}
+        # format -> sorted list of (tool id, output format), built on demand
+        self._successors = None
+
+    def add_tool(self, idee, inputs, outputs):
+        """
+        Add a tool with its input and output formats, the formats of tools
+        with the same id are merged.
+        """
+        self.inputs.setdefault(idee, set()).update(inputs)
+        self.outputs.setdefault(idee, set()).update(outputs)
+        for f in inputs:
+            self.consumers.setdefault(f, set()).add(idee)
+        for f in outputs:
+            self.producers.setdefault(f, set()).add(idee)
+        self._successors = None
+
+    @property
+    def tools(self):
+        return set(self.inputs)
+
+    @property
+    def formats(self):
+        return set(self.consumers) | set(self.producers)
+
+    def iter_edges(self):
+        """
+        Iterate over the edges of the graph sorted by tool id.
+
+        Yields
+        ------
+        Tuple (source, target, kind), either (format, tool id, "input") or
+        (tool id, format, "output")
+        """
+        for idee in sorted(self.inputs):
+            for f in sorted(self.inputs[idee]):
+                yield f, idee, "input"
+            for f in sorted(self.outputs[idee]):
+                yield idee, f, "output"
+
+    def edges(self):
+        """
+        Get the edges of the graph in DOT format.
+        """
+        return {"%s -> %s;" % (source, target) for source, target, _ in self.iter_edges()}
+
+    def consumers_of(self, idee):
+        """
+        Get the tools that can consume an output of a tool.
+
+        Parameters
+        ----------
+        idee: str
+        Tool id
+
+        Returns
+        -------
+        Set of tool ids
+        """
+        consumers = set()
+        for f in self.outputs.get(idee, ()):
+            consumers.update(self.consumers.get(f, ()))
+        return consumers
+
+    def shortest_chain(self, source, target):
+        """
+        Find a shortest chain of tools converting a format into another by
+        breadth first search over the formats.
+
+        Parameters
+        ----------
+        source: str
+        Format of the input of the first tool
+        target: str
+        Format of the output of the last tool
+
+        Returns
+        -------
+        List alternating formats and tool ids starting with source and ending
+        with target or None if there is no chain
+        """
+        if self._successors is None:
+            self._successors = {
+                f: sorted((idee, g) for idee in tools for g in self.outputs[idee])
+                for f, tools in self.consumers.items()
+            }
+        parents = {source: None}
+        queue = deque([source])
+        while queue:
+            f = queue.popleft()
+            if f == target:
+                chain = [f]
+                while parents[f] is not None:
+                    f, idee = parents[f]
+                    chain.extend([idee, f])
+                return chain[::-1]
+            for idee, g in self._successors.get(f, ()):
+                if g not in parents:
+                    parents[g] = (f, idee)
+                    queue.append(g)
+        return None
+
+
+def split_formats(formats):
+    return {f.strip() for f in formats.split(",") if f.strip()}
+
+
+def extract_output_formats(toolxml, output, input_params):
+    """
+    Get the formats of an output (data or collection element).
+
+    Considered are the format attributes of the output and its nested data
+    and discover_datasets elements, the formats of the input referenced by
+    format_source and the formats of change_format. The legacy format
+    "input" is replaced by the formats of all inputs.
+
+    Parameters
+    ----------
+    toolxml: str
+    Path of the tool xml file (for messages)
+    output: Element
+    The data or collection element
+    input_params: dict
+    Formats of the data inputs by parameter name
+
+    Returns
+    -------
+    Set of formats
+    """
+    formats = set()
+    for elem in output.iter():
+        if elem.tag in ("data", "collection"):
+            formats.update(split_formats(elem.attrib.get("format", "")))
+            if "format_source" in elem.attrib:
+                # the name may contain the path of the param in conditionals, sections, ...
+                name = elem.attrib["format_source"].split("|")[-1]
+                if name in input_params:
+                    formats.update(input_params[name])
+                else:
+                    logging.warning("%s: format_source %s of output %s not found" % (toolxml, name, output.attrib.get("name")))
+        elif elem.tag == "discover_datasets":
+            formats.update(split_formats(elem.attrib.get("format", elem.attrib.get("ext", ""))))
+        elif elem.tag == "when" and "format" in elem.attrib:
+            formats.add(elem.attrib["format"])
+    if "input" in formats:
+        formats.remove("input")
+        for param_formats in input_params.values():
+            formats.update(param_formats)
+    return formats
+
+
+def extract_toolxml(toolxml):
+    """
+    Extract the tool id and the input and output formats from a tool xml file.
+
+    The file is parsed incrementally and parsing stops as soon as the inputs
+    and outputs sections of the tool have been read, i.e. the remaining part
+    of the file (tests, help, ...) is never materialized. Macros are expanded
+    and tokens are replaced.
+
+    Parameters
+    ----------
+    toolxml: str
+    Path of the tool xml file
+
+    Returns
+    -------
+    Tuple (tool id, set of input formats, set of output formats, set of the
+    paths of the imported macro files) or None if the file is no tool xml file
+    or can not be read or parsed
+    """
+    root = None
+    # depth of the current element, the sections of the tool have depth 1
+    depth = 0
+    # tags of the completely parsed sections
+    complete = set()
+    parser = ET.XMLPullParser(events=("start", "end"))
+    try:
+        with open(toolxml, "rb") as handle:
+            while not ("inputs" in complete and "outputs" in complete):
+                data = handle.read(BLOCK_SIZE)
+                if not data:
+                    parser.close()
+                    break
+                parser.feed(data)
+                for event, elem in parser.read_events():
+                    if event == "start":
+                        if root is None:
+                            if elem.tag != "tool":
+                                logging.warning("%s: seems to be no tool xml file" % toolxml)
+                                return None
+                            root = elem
+                        depth += 1
+                        continue
+                    depth -= 1
+                    if depth != 1:
+                        continue
+                    # a section of the tool is complete with its end tag
+                    complete.add(elem.tag)
+                    if elem.tag not in KEEP_SECTIONS:
+                        # drop other sections of the tool (command, help, ...)
+                        elem.clear()
+                    if "inputs" in complete and "outputs" in complete:
+                        break
+    except ET.ParseError as e:
+        logging.error("%s: could not be parsed: %s" % (toolxml, e))
+        return None
+    except OSError as e:
+        logging.error("%s: could not be read: %s" % (toolxml, e.strerror))
+        return None
+
+    macro_files = set()
+    macros = root.find("macros")
+    if macros is not None:
+        xml_macros, tokens, macro_files = collect_macros(macros, os.path.dirname(toolxml))
+        expand_macros(root, xml_macros)
+        replace_tokens(root, tokens)
+
+    idee = root.attrib["id"]
+    inputs = root.find("inputs")
+    outputs = root.find("outputs")
+
+    # formats of the data inputs (also in conditionals, sections, ...) by name
+    input_params = {}
+    if inputs is None:
+        logging.error("%s: no inputs found" % toolxml)
     else:
-        for p in inputs.iterfind("param"):
-            if not "type" in p.attrib or p.attrib["type"]!="data":
+        for p in inputs.iter("param"):
+            if p.attrib.get("type") not in DATA_PARAM_TYPES:
                 continue
-            if not "format" in p.attrib:
+            if "format" not in p.attrib:
                 continue
-            for f in p.attrib["format"].split(","):
-                edges.add( "%s -> %s;" %(f, idee ))
-    outputs = e.find("outputs")
-    if outputs == None:
-        logging.error("%s: no outputs found"%toolxml)
+            input_params.setdefault(p.attrib.get("name"), set()).update(split_formats(p.attrib["format"]))
+    input_formats = set().union(*input_params.values())
+    output_formats = set()
+    if outputs is None:
+        logging.error("%s: no outputs found" % toolxml)
     else:
-        for p in inputs.iterfind("param"):
-            if not "format" in p.attrib:
-                continue
-            for f in p.attrib["format"].split(","):
-                edges.add( "%s -> %s;" %(idee, f ))
-tools = set()
-edges = set()
-for i in range(1, len(sys.argv)):
-    process_toolxml( sys.argv[i], tools, edges )
-
-tools = [ "%s [shape=box];"%x for x in tools ]
-print """
-digraph G {{
-{tools}
-{edges}
-}}""".format(tools = "\n".join(tools), edges = "\n".join(edges))
-
-# TODO 
+        for output in outputs:
+            if output.tag in ("data", "collection"):
+                output_formats.update(extract_output_formats(toolxml, output, input_params))
+    return idee, input_formats, output_formats, macro_files
+
+
+def process_toolxml(toolxml, tools, edges):
+    """
+    Add the tool and the edges of a tool xml file to the given sets.
+    """
+    result = extract_toolxml(toolxml)
+    if result is None:
+        return
+    idee, input_formats, output_formats, _ = result
+    graph = ToolGraph()
+    graph.add_tool(idee, input_formats, output_formats)
+    tools.add(idee)
+    edges.update(graph.edges())
+
+
+def file_hash(path, hashes=None):
+    """
+    Get the SHA-256 hash of the content of a file.
+
+    Parameters
+    ----------
+    path: str
+    Path of the file
+    hashes: dict
+    Optional dict of already computed hashes by path that is used and updated
+
+    Returns
+    -------
+    Hex digest or None if the file can not be read
+    """
+    if hashes is not None and path in hashes:
+        return hashes[path]
+    try:
+        with open(path, "rb") as handle:
+            digest = hashlib.sha256(handle.read()).hexdigest()
+    except OSError:
+        digest = None
+    if hashes is not None:
+        hashes[path] = digest
+    return digest
+
+
+def cache_key(toolxml):
+    """
+    Get the key of a tool xml file in the edge cache.
+
+    The key combines the directory of the file with the hash of its content
+    since macro files are imported relative to the tool xml file, i.e. the
+    same content in another directory can give other edges. The directory is
+    not resolved further since symbolic links are not followed for macros
+    either.
+
+    Returns
+    -------
+    str or None if the file can not be read
+    """
+    digest = file_hash(toolxml)
+    if digest is None:
+        return None
+    return "%s:%s" % (os.path.dirname(os.path.abspath(toolxml)), digest)
+
+
+def read_cache(path):
+    """
+    Read the edge cache file, a missing or outdated cache is treated as empty.
+
+    Returns
+    -------
+    dict of cache entries by the key of the tool xml file (see cache_key)
+    """
+    try:
+        with open(path) as handle:
+            cache = json.load(handle)
+    except FileNotFoundError:
+        return {}
+    except ValueError:
+        logging.warning("%s: invalid cache file, ignoring it" % path)
+        return {}
+    if cache.get("version") != CACHE_VERSION:
+        return {}
+    return cache["tools"]
+
+
+def write_cache(path, entries):
+    """
+    Write the edge cache file (atomically by renaming a temporary file).
+    """
+    tmp_path = "%s.tmp" % path
+    with open(tmp_path, "w") as handle:
+        json.dump({"version": CACHE_VERSION, "tools": entries}, handle, sort_keys=True)
+    os.replace(tmp_path, path)
+
+
+def process_toolxmls(toolxmls, processes=1, cache_path=None):
+    """
+    Build the graph of many tool xml files.
+
+    With a cache file only tool xml files whose content or imported macro
+    files changed since the last run are parsed. The cache stores the tool id
+    and the input and output formats of every tool by the directory and the
+    hash of the content of its xml file and it is rewritten with the entries
+    of the given tool xml files.
+
+    Parameters
+    ----------
+    toolxmls: list of str
+    Paths of the tool xml files
+    processes: int
+    Number of worker processes used for parsing, 1 parses in this process
+    cache_path: str
+    Optional path of the cache file
+
+    Returns
+    -------
+    ToolGraph
+    """
+    cache = read_cache(cache_path) if cache_path else {}
+    # cache keys of the tool xml files (None if no cache is used)
+    keys = []
+    # hashes of the macro files
+    hashes = {}
+    entries = {}
+    todo = []
+    for toolxml in toolxmls:
+        key = cache_key(toolxml) if cache_path else None
+        keys.append(key)
+        entry = cache.get(key)
+        if entry is not None and all(file_hash(path, hashes) == digest for path, digest in entry["macros"].items()):
+            entries[key] = entry
+        else:
+            todo.append(toolxml)
+
+    if processes > 1 and len(todo) > 1:
+        with multiprocessing.Pool(processes) as pool:
+            results = list(pool.imap(extract_toolxml, todo, chunksize=CHUNK_SIZE))
+    else:
+        results = map(extract_toolxml, todo)
+    results = dict(zip(todo, results))
+
+    graph = ToolGraph()
+    for toolxml, key in zip(toolxmls, keys):
+        if toolxml in results:
+            result = results[toolxml]
+            if result is None:
+                entry = {"id": None, "inputs": [], "outputs": [], "macros": {}}
+            else:
+                idee, input_formats, output_formats, macro_files = result
+                entry = {"id": idee, "inputs": sorted(input_formats), "outputs": sorted(output_formats),
+                         "macros": {path: file_hash(path, hashes) for path in macro_files}}
+            if key is not None:
+                entries[key] = entry
+        else:
+            entry = entries[key]
+        if entry["id"] is None:
+            continue
+        graph.add_tool(entry["id"], entry["inputs"], entry["outputs"])
+
+    if cache_path:
+        write_cache(cache_path, entries)
+    return graph
+
+
+def write_dot(graph, handle):
+    """
+    Write the graph in DOT format, tools are drawn as boxes.
+    """
+    handle.write("\ndigraph G {\n")
+    for idee in sorted(graph.tools):
+        handle.write("%s [shape=box];\n" % idee)
+    for edge in sorted(graph.edges()):
+        handle.write("%s\n" % edge)
+    handle.write("}\n")
+
+
+def write_jsonl(graph, handle):
+    """
+    Write the graph as JSON lines: one object per node
+    ({"type": "tool"|"format", "id": ...}) followed by one object per edge
+    ({"type": "edge", "source": ..., "target": ..., "kind": "input"|"output"}).
+    """
+    for idee in sorted(graph.tools):
+        handle.write(json.dumps({"type": "tool", "id": idee}) + "\n")
+    for f in sorted(graph.formats):
+        handle.write(json.dumps({"type": "format", "id": f}) + "\n")
+    for source, target, kind in graph.iter_edges():
+        handle.write(json.dumps({"type": "edge", "source": source, "target": target, "kind": kind}) + "\n")
+
+
+def write_graphml(graph, handle):
+    """
+    Write the graph in GraphML format. Node ids are prefixed by tool: and
+    format: since tool ids and formats may coincide, the kind and the name of
+    a node are given as data.
+    """
+    handle.write('<?xml version="1.0" encoding="UTF-8"?>\n')
+    handle.write('<graphml xmlns="http://graphml.graphdrawing.org/xmlns">\n')
+    handle.write('  <key id="kind" for="node" attr.name="kind" attr.type="string"/>\n')
+    handle.write('  <key id="name" for="node" attr.name="name" attr.type="string"/>\n')
+    handle.write('  <graph id="G" edgedefault="directed">\n')
+    for kind, names in (("tool", sorted(graph.tools)), ("format", sorted(graph.formats))):
+        for name in names:
+            handle.write('    <node id=%s><data key="kind">%s</data><data key="name">%s</data></node>\n'
+                         % (quoteattr("%s:%s" % (kind, name)), kind, escape(name)))
+    for source, target, kind in graph.iter_edges():
+        if kind == "input":
+            source, target = "format:%s" % source, "tool:%s" % target
+        else:
+            source, target = "tool:%s" % source, "format:%s" % target
+        handle.write('    <edge source=%s target=%s/>\n' % (quoteattr(source), quoteattr(target)))
+    handle.write('  </graph>\n')
+    handle.write('</graphml>\n')
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Print the graph of the input and output formats of Galaxy tools")
+    parser.add_argument("toolxml", nargs="*", help="Tool xml files")
+    parser.add_argument("--processes", type=int, default=1, help="Number of processes used for parsing the tool xml files")
+    parser.add_argument("--cache", default=None, help="Cache file of the edges of the tools, only changed tool xml files are parsed")
+    parser.add_argument("--output-format", choices=OUTPUT_FORMATS, default="dot", help="Format of the graph")
+    parser.add_argument("--consumers", metavar="TOOL", action="append", default=[],
+                        help="Instead of the graph print the tools that can consume an output of the tool, can be repeated")
+    parser.add_argument("--chain", metavar=("FROM", "TO"), nargs=2, action="append", default=[],
+                        help="Instead of the graph print a shortest chain of tools converting format FROM into format TO, can be repeated")
+    args = parser.parse_args()
+
+    graph = process_toolxmls(args.toolxml, args.processes, args.cache)
+    if not (args.consumers or args.chain):
+        writers = {"dot": write_dot, "jsonl": write_jsonl, "graphml": write_graphml}
+        writers[args.output_format](graph, sys.stdout)
+    for idee in args.consumers:
+        print("%s: %s" % (idee, " ".join(sorted(graph.consumers_of(idee)))))
+    for source, target in args.chain:
+        chain = graph.shortest_chain(source, target)
+        print("%s to %s: %s" % (source, target, "no chain" if chain is None else " -> ".join(chain)))
+
+
+if __name__ == "__main__":
+    main()
+
+# TODO
 # - mark optional input
@@ -0,0 +1,210 @@
+#!/usr/bin/env python
+
+# benchmark for getLongestORF.py (not part of the Galaxy tool)
+#
+# generate a synthetic ORF FASTA file in the format of EMBOSS getorf:
+#   python benchmark_longorf.py generate --transcripts 100000 --orfs 8 orfs.fasta
+# benchmark several command line variants on it:
+#   python benchmark_longorf.py run orfs.fasta --variant= --variant="--threads 8" --variant=--index
+
+import argparse
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import time
+
+from getLongestORF import open_input, SUMMARY_HEADER, SUMMARY_ROW
+
+SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "getLongestORF.py")
+TEST_DATA = os.path.join(os.path.dirname(os.path.abspath(__file__)), "test-data")
+AMINO_ACIDS = "ACDEFGHIKLMNPQRSTVWY"
+
+
+def generate(path, transcripts, orfs, min_length, max_length, line_width, seed):
+    """
+    Write a synthetic ORF FASTA file.
+
+    Parameters
+    ----------
+    path: str
+    Path of the FASTA file
+    transcripts: int
+    Number of transcripts
+    orfs: int
+    Maximum number of ORFs per transcript, the number is drawn uniformly
+    from 1 to orfs
+    min_length, max_length: int
+    Range of the ORF lengths in amino acids
+    line_width: int
+    Number of residues per sequence line, 0 for single line sequences
+    seed: int
+    Seed of the random number generator
+
+    Returns
+    -------
+    Number of written records
+    """
+    rng = random.Random(seed)
+    records = 0
+    with open(path, "w") as handle:
+        for t in range(transcripts):
+            strand = rng.choice("+-")
+            for k in range(1, rng.randint(1, orfs) + 1):
+                length = rng.randint(min_length, max_length)
+                start = rng.randint(1, 3 * max_length)
+                if rng.random() < 0.5:
+                    end = start + 3 * length - 1
+                    sense = ""
+                else:
+                    start, end = start + 3 * length - 1, start
+                    sense = " (REVERSE SENSE)"
+                handle.write(f">STRG.{t}.1({strand})_{k} [{start} - {end}]{sense}\n")
+                seq = "".join(rng.choices(AMINO_ACIDS, k=length))
+                if line_width > 0:
+                    handle.write("\n".join(seq[i:i + line_width] for i in range(0, len(seq), line_width)) + "\n")
+                else:
+                    handle.write(seq + "\n")
+                records += 1
+    return records
+
+
+def count_records(path):
+    with open_input(path) as handle:
+        return sum(1 for line in handle if line.startswith(">"))
+
+
+def run_tool(input_path, out_dir, variant):
+    """
+    Run getLongestORF.py in a subprocess.
+
+    Returns
+    -------
+    Tuple (wall time in seconds, peak RSS in MB, FASTA output path, summary
+    output path)
+    """
+    fasta_path = os.path.join(out_dir, "longest.fasta")
+    summary_path = os.path.join(out_dir, "orfs.tab")
+    command = [sys.executable, SCRIPT, *variant.split(), input_path, fasta_path, summary_path]
+    start = time.perf_counter()
+    process = subprocess.Popen(command)
+    _, status, rusage = os.wait4(process.pid, 0)
+    elapsed = time.perf_counter() - start
+    process.returncode = os.waitstatus_to_exitcode(status)
+    if process.returncode != 0:
+        raise subprocess.CalledProcessError(process.returncode, command)
+    # ru_maxrss is in kB on Linux, wait4 reports the maximum over the process and
+    # its reaped worker processes (not their sum)
+    return elapsed, rusage.ru_maxrss / 1024, fasta_path, summary_path
+
+
+def summary_format(variant):
+    """
+    Get the --summary-format of a command line variant.
+    """
+    options = variant.split()
+    for i, option in enumerate(options):
+        if option == "--summary-format" and i + 1 < len(options):
+            return options[i + 1]
+        if option.startswith("--summary-format="):
+            return option.split("=", 1)[1]
+    return "tabular"
+
+
+def read_lines(path, file_format="tabular"):
+    """
+    Read the lines of an output file, Parquet and Arrow summaries are
+    converted to the lines of the tabular summary.
+    """
+    if file_format == "tabular":
+        with open(path) as handle:
+            return handle.read().split("\n")
+    import pyarrow.ipc
+    import pyarrow.parquet
+
+    if file_format == "parquet":
+        table = pyarrow.parquet.read_table(path)
+    else:
+        with pyarrow.ipc.open_file(path) as reader:
+            table = reader.read_all()
+    rows = zip(*(column.to_pylist() for column in table.columns))
+    text = SUMMARY_HEADER + "".join(SUMMARY_ROW % (*row[:-1], "y" if row[-1] else "n") for row in rows)
+    return text.split("\n")
+
+
+def same_lines(path, expected_path, ordered=True, file_format="tabular"):
+    lines = read_lines(path, file_format)
+    expected = read_lines(expected_path)
+    if not ordered:
+        lines.sort()
+        expected.sort()
+    return lines == expected
+
+
+def check(variants):
+    """
+    Verify every variant against the expected outputs of the tool test.
+
+    The order of the output is not checked for unsorted input. Parquet and
+    Arrow summaries are compared with the tabular summary of the test.
+    """
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        input_path = os.path.join(tmp_dir, "test_input.fasta")
+        with open(os.path.join(TEST_DATA, "test_input.fasta")) as source, open(input_path, "w") as target:
+            target.write(source.read())
+        for variant in variants:
+            _, _, fasta_path, summary_path = run_tool(input_path, tmp_dir, variant)
+            ordered = "--unsorted" not in variant.split()
+            if not (same_lines(fasta_path, os.path.join(TEST_DATA, "test_output.fasta"), ordered)
+                    and same_lines(summary_path, os.path.join(TEST_DATA, "test_output.tab"), ordered, summary_format(variant))):
+                raise SystemExit(f"variant '{variant}' does not reproduce the test outputs")
+
+
+def benchmark(input_path, variants, repeat):
+    """
+    Print the throughput and peak memory of the variants as a table.
+    """
+    records = count_records(input_path)
+    megabytes = os.path.getsize(input_path) / 1024 ** 2
+    print("variant\trecords\tMB\tseconds\trecords/s\tMB/s\tpeak_rss_MB")
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        for variant in variants:
+            runs = [run_tool(input_path, tmp_dir, variant) for _ in range(repeat)]
+            elapsed = min(run[0] for run in runs)
+            peak_rss = max(run[1] for run in runs)
+            print(f"{variant or '(default)'}\t{records}\t{megabytes:.1f}\t{elapsed:.3f}\t{records / elapsed:.0f}\t{megabytes / elapsed:.1f}\t{peak_rss:.1f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark getLongestORF.py on synthetic ORF FASTA files.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    generate_parser = subparsers.add_parser("generate", help="Write a synthetic ORF FASTA file")
+    generate_parser.add_argument("output", help="Path of the FASTA file")
+    generate_parser.add_argument("--transcripts", type=int, default=100000, help="Number of transcripts")
+    generate_parser.add_argument("--orfs", type=int, default=8, help="Maximum number of ORFs per transcript")
+    generate_parser.add_argument("--min-length", type=int, default=30, help="Minimum ORF length")
+    generate_parser.add_argument("--max-length", type=int, default=600, help="Maximum ORF length")
+    generate_parser.add_argument("--line-width", type=int, default=0, help="Residues per sequence line, 0 for single line sequences")
+    generate_parser.add_argument("--seed", type=int, default=0, help="Seed of the random number generator")
+
+    run_parser = subparsers.add_parser("run", help="Benchmark getLongestORF.py on a FASTA file")
+    run_parser.add_argument("input", help="ORF FASTA file, e.g. written by the generate command")
+    run_parser.add_argument("--variant", action="append", help="Command line options of getLongestORF.py to benchmark, can be repeated (default: no options)")
+    run_parser.add_argument("--repeat", type=int, default=3, help="Number of runs per variant, the fastest run is reported")
+    run_parser.add_argument("--no-check", action="store_true", help="Do not verify the variants on the test data first")
+    args = parser.parse_args()
+
+    if args.command == "generate":
+        records = generate(args.output, args.transcripts, args.orfs, args.min_length, args.max_length, args.line_width, args.seed)
+        print(f"Wrote {records} ORFs of {args.transcripts} transcripts to {args.output}")
+    else:
+        variants = args.variant or [""]
+        if not args.no_check:
+            check(variants)
+        benchmark(args.input, variants, args.repeat)
+
+
+if __name__ == "__main__":
+    main()
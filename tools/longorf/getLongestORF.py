@@ -1,108 +1,822 @@
 #!/usr/bin/env python
 
-#example:
-#>STRG.1.1(-)_1 [10 - 69]
-#GGNHHTLGGKKTFSYTHPPC
-#>STRG.1.1(-)_2 [3 - 80]
-#FLRGEPPHIGGKKDIFLHPPTLLKGR
-
-#output1: fasta file with all longest ORFs per transcript
-#output2: table with information about seqID, transcript, start, end, strand, length, sense, longest? for all ORFs
-
-import sys,re;
-
-def findlongestOrf(transcriptDict,old_seqID):
-	#write for previous seqID
-	prevTranscript = transcriptDict[old_seqID];
-	i_max = 0;
-	transcript = old_seqID.split("(")[0]
-
-	#find longest orf in transcript
-	for i in range(0,len(prevTranscript)):
-		if(prevTranscript[i][2] >= prevTranscript[i_max][2]):
-			i_max = i;
-
-	for i in range(0,len(prevTranscript)):
-		prevORFstart = prevTranscript[i][0];
-		prevORFend = prevTranscript[i][1];
-		prevORFlength = prevTranscript[i][2];
-		header = prevTranscript[i][3];
-		strand = re.search('\(([+-]+)\)',header).group(1);
-		
-		output = str(header) + "\t" + str(transcript) + "\t" + str(prevORFstart) + "\t" + str(prevORFend) + "\t" + str(prevORFlength) + "\t" + str(strand);
-		if (prevORFend - prevORFstart > 0):
-			output+="\tnormal";
-		else:
-			output+="\treverse_sense";
-		if(i == i_max):
-			output += "\ty\n";
-		else:
-			output += "\tn\n";
-
-		OUTPUT_ORF_SUMMARY.write(output);
-
-	transcriptDict.pop(old_seqID, None);
-	return None;
-
-#-----------------------------------------------------------------------------------------------------
-
-INPUT = open(sys.argv[1],"r");
-OUTPUT_FASTA = open(sys.argv[2],"w");
-OUTPUT_ORF_SUMMARY = open(sys.argv[3],"w");
-
-seqID = "";
-old_seqID = "";
-lengthDict = {};
-seqDict = {};
-headerDict = {};
-transcriptDict = {};
-
-skip = False;
-
-OUTPUT_ORF_SUMMARY.write("seqID\ttranscript\torf_start\torf_end\tlength\tstrand\tsense\tlongest\n");
-
-for line in INPUT:
-	line = line.strip();
-	if(re.match(">",line)): #header
-		header = line.split(">")[1].split(" ")[0]
-		seqID = "_".join(line.split(">")[1].split("_")[:-1])
-		ORFstart = int (re.search('\ \[(\d+)\ -', line).group(1));
-		ORFend = int (re.search('-\ (\d+)\]',line).group(1));
-		length = abs(ORFend - ORFstart);
-
-		if(seqID not in transcriptDict and old_seqID != ""): #new transcript
-			findlongestOrf(transcriptDict,old_seqID);
-			
-		if seqID not in transcriptDict:
-			transcriptDict[seqID] = [];
-
-		transcriptDict[seqID].append([ORFstart,ORFend,length,header]);
-
-		if(seqID not in lengthDict and old_seqID != ""): #new transcript
-			#write FASTA
-			OUTPUT_FASTA.write(headerDict[old_seqID]+"\n"+seqDict[old_seqID]+"\n");
-			#delete old dict entry
-			headerDict.pop(old_seqID, None);
-			seqDict.pop(old_seqID, None);
-			lengthDict.pop(old_seqID, None);
-		#if several longest sequences exist with the same length, the dictionary saves the last occuring.
-		if(seqID not in lengthDict or length >= lengthDict[seqID]):
-			headerDict[seqID] = line;
-			lengthDict[seqID] = length;
-			seqDict[seqID] = "";
-			skip = False;
-		else:
-			skip = True;
-			next;
-		old_seqID = seqID;
-	elif(skip):
-		next;
-	else:
-		seqDict[seqID] += line;
-
-OUTPUT_FASTA.write(headerDict[old_seqID]+"\n"+seqDict[old_seqID]);
-findlongestOrf(transcriptDict,old_seqID);
-
-INPUT.close();
-OUTPUT_FASTA.close();
-OUTPUT_ORF_SUMMARY.close();
\ No newline at end of file
+# example:
+# >STRG.1.1(-)_1 [10 - 69]
+# GGNHHTLGGKKTFSYTHPPC
+# >STRG.1.1(-)_2 [3 - 80]
+# FLRGEPPHIGGKKDIFLHPPTLLKGR
+
+# output1: fasta file with all longest ORFs per transcript (optionally the top k, per sense)
+# output2: table with information about seqID, transcript, start, end, strand, length, sense, longest? for all ORFs
+
+# The input is processed as a stream: records are read one at a time and
+# grouped into transcripts, so peak memory is bounded by the largest single
+# transcript and not by the size of the input.
+
+import argparse
+import codecs
+import contextlib
+import gzip
+import heapq
+import io
+import itertools
+import mmap
+import multiprocessing
+import operator
+import os
+import queue
+import re
+import shutil
+import tempfile
+import threading
+import zlib
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+# header grammar of getorf, e.g. ">STRG.1.1(-)_2 [3 - 80] (REVERSE SENSE)"
+HEADER_RE = re.compile(
+    r">(?P<header>(?P<seqID>(?P<transcript>[^\s(]*)\S*?\((?P<strand>[+-]+)\)\S*)_\S*?)"
+    r"\s+\[(?P<start>\d+) - (?P<end>\d+)\]"
+)
+
+SUMMARY_HEADER = "seqID\ttranscript\torf_start\torf_end\tlength\tstrand\tsense\tlongest\n"
+SUMMARY_ROW = "%s\t%s\t%d\t%d\t%d\t%s\t%s\t%s\n"
+SUMMARY_BATCH_SIZE = 10000
+# rows per record batch / row group of Arrow and Parquet summaries
+ARROW_BATCH_SIZE = 100000
+SUMMARY_FORMATS = ("tabular", "parquet", "arrow")
+# values of the dictionary-encoded columns, Arrow IPC files need the same
+# dictionary in all record batches
+SUMMARY_DICTIONARIES = {
+    "strand": ("+", "-"),
+    "sense": ("normal", "reverse_sense"),
+}
+IO_BUFFER_SIZE = 1024 * 1024
+# number of chunks per worker process, more chunks balance the load better
+CHUNKS_PER_THREAD = 4
+DEFAULT_PARTITIONS = 64
+# number of decompressed blocks buffered between the decompression thread
+# and the parser
+DECOMPRESS_QUEUE_SIZE = 8
+
+GZIP_MAGIC = b"\x1f\x8b"
+ZSTD_MAGIC = b"\x28\xb5\x2f\xfd"
+
+
+def read_fasta(handle):
+    """
+    Iterate over the records of a FASTA file.
+
+    Parameters
+    ----------
+    handle: file
+    Open text handle of the FASTA file
+
+    Returns
+    -------
+    Generator of (header line, sequence) tuples
+    """
+    header = None
+    buffer = []
+    for line in handle:
+        line = line.strip()
+        if line.startswith(">"):
+            if header is not None:
+                yield header, "".join(buffer)
+            header = line
+            buffer = []
+        elif header is not None:
+            buffer.append(line)
+    if header is not None:
+        yield header, "".join(buffer)
+
+
+def parse_header(line):
+    """
+    Extract the ORF information from a getorf header line in a single pass.
+
+    Returns
+    -------
+    Tuple (seqID, ORF information), the ORF information being the summary
+    table columns header, transcript, start, end, length, strand and sense
+    """
+    match = HEADER_RE.match(line)
+    if match is None:
+        raise ValueError(f"Invalid ORF header: {line}")
+    header, seqID, transcript, strand, start, end = match.groups()
+    start = int(start)
+    end = int(end)
+    sense = "normal" if end - start > 0 else "reverse_sense"
+    return seqID, (header, transcript, start, end, abs(end - start), strand, sense)
+
+
+def iter_transcripts(records):
+    """
+    Group consecutive FASTA records by transcript.
+
+    Parameters
+    ----------
+    records: iterable
+    (header line, sequence) tuples as returned by read_fasta
+
+    Returns
+    -------
+    Generator of (seqID, records) tuples, records being a lazy iterator of
+    (seqID, ORF information, header line, sequence) tuples of one transcript
+    """
+    orfs = (parse_header(line) + (line, seq) for line, seq in records)
+    return itertools.groupby(orfs, key=operator.itemgetter(0))
+
+
+def find_longest_orfs(group, top=1, per_sense=False):
+    """
+    Reduce the ORFs of one transcript to its `top` longest ORFs.
+
+    A bounded min-heap of (length, position) keeps the current selection, so
+    only the sequences of the selected ORFs are kept in memory. If several
+    ORFs have the same length, the later ones are preferred.
+
+    Parameters
+    ----------
+    group: iterable
+    (seqID, ORF information, header line, sequence) tuples of one transcript
+    top: int
+    Number of ORFs to select
+    per_sense: bool
+    Select `top` ORFs each among the normal and the reverse sense ORFs
+
+    Returns
+    -------
+    Tuple (list of ORF information, list of (length, position, header line,
+    sequence) tuples of the selected ORFs in input order)
+    """
+    orfs = []
+    heaps = {}
+    for i, (seqID, orf, line, seq) in enumerate(group):
+        orfs.append(orf)
+        heap = heaps.setdefault(orf[6] if per_sense else None, [])
+        entry = (orf[4], i, line, seq)
+        if len(heap) < top:
+            heapq.heappush(heap, entry)
+        elif entry > heap[0]:
+            heapq.heapreplace(heap, entry)
+    selected = sorted(itertools.chain.from_iterable(heaps.values()), key=operator.itemgetter(1))
+    return orfs, selected
+
+
+class SummaryWriter:
+    """
+    Buffered writer for the ORF summary table.
+
+    Rows are formatted with a single template and written in batches of
+    `batch_size` rows.
+    """
+
+    def __init__(self, handle, header=True, batch_size=SUMMARY_BATCH_SIZE):
+        self.handle = handle
+        self.batch_size = batch_size
+        self.rows = []
+        if header:
+            handle.write(SUMMARY_HEADER)
+
+    def add(self, orfs, selected):
+        self.rows.extend(
+            SUMMARY_ROW % (orf + ("y" if i in selected else "n",))
+            for i, orf in enumerate(orfs)
+        )
+        if len(self.rows) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        self.handle.writelines(self.rows)
+        self.rows = []
+
+    def add_tabular(self, handle):
+        """
+        Append the rows of a summary table without header line.
+        """
+        self.flush()
+        shutil.copyfileobj(handle, self.handle, IO_BUFFER_SIZE)
+
+    def close(self):
+        self.flush()
+
+
+class ArrowSummaryWriter:
+    """
+    Writer for the ORF summary table in Parquet or Arrow IPC file format.
+
+    Positions and lengths are stored as integers, strand and sense are
+    dictionary-encoded and the longest column is boolean.
+    """
+
+    def __init__(self, path, file_format, batch_size=ARROW_BATCH_SIZE):
+        # pyarrow is only imported for Arrow and Parquet output since importing
+        # it takes longer than processing small inputs
+        try:
+            import pyarrow
+            import pyarrow.compute
+            import pyarrow.ipc
+            import pyarrow.parquet
+        except ImportError:
+            raise RuntimeError(f"{file_format} output needs the pyarrow package") from None
+        self.pyarrow = pyarrow
+        dictionary = pyarrow.dictionary(pyarrow.int32(), pyarrow.string())
+        self.schema = pyarrow.schema([
+            ("seqID", pyarrow.string()),
+            ("transcript", pyarrow.string()),
+            ("orf_start", pyarrow.int64()),
+            ("orf_end", pyarrow.int64()),
+            ("length", pyarrow.int64()),
+            ("strand", dictionary),
+            ("sense", dictionary),
+            ("longest", pyarrow.bool_()),
+        ])
+        if file_format == "parquet":
+            self.writer = pyarrow.parquet.ParquetWriter(path, self.schema)
+        else:
+            self.writer = pyarrow.ipc.new_file(path, self.schema)
+        self.batch_size = batch_size
+        self.rows = []
+
+    def add(self, orfs, selected):
+        self.rows.extend(orf + (i in selected,) for i, orf in enumerate(orfs))
+        if len(self.rows) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        if not self.rows:
+            return
+        pyarrow = self.pyarrow
+        columns = []
+        for field, values in zip(self.schema, zip(*self.rows)):
+            if field.name in SUMMARY_DICTIONARIES:
+                dictionary = pyarrow.array(SUMMARY_DICTIONARIES[field.name], pyarrow.string())
+                indices = pyarrow.compute.index_in(pyarrow.array(values, pyarrow.string()), value_set=dictionary)
+                if indices.null_count > 0:
+                    raise ValueError(f"Unexpected {field.name} in ORF summary: {set(values) - set(SUMMARY_DICTIONARIES[field.name])}")
+                columns.append(pyarrow.DictionaryArray.from_arrays(indices, dictionary))
+            else:
+                columns.append(pyarrow.array(values, field.type))
+        self.writer.write_batch(pyarrow.record_batch(columns, schema=self.schema))
+        self.rows = []
+
+    def add_tabular(self, handle):
+        """
+        Append the rows of a summary table without header line.
+        """
+        for line in handle:
+            header, transcript, start, end, length, strand, sense, longest = line.rstrip("\n").split("\t")
+            self.rows.append((header, transcript, int(start), int(end), int(length), strand, sense, longest == "y"))
+            if len(self.rows) >= self.batch_size:
+                self.flush()
+
+    def close(self):
+        self.flush()
+        self.writer.close()
+
+
+@contextlib.contextmanager
+def open_summary(path, file_format="tabular"):
+    """
+    Open a writer for the ORF summary table.
+
+    Parameters
+    ----------
+    path: str
+    Path of the summary table, tabular output is compressed if the name
+    ends with .gz or .zst
+    file_format: str
+    One of SUMMARY_FORMATS
+    """
+    if file_format == "tabular":
+        with open_output(path) as handle:
+            summary = SummaryWriter(handle)
+            yield summary
+            summary.close()
+    else:
+        summary = ArrowSummaryWriter(path, file_format)
+        try:
+            yield summary
+        finally:
+            summary.close()
+
+
+def longest_orfs(records, summary, top=1, per_sense=False):
+    """
+    Select the longest ORFs of each transcript.
+
+    Parameters
+    ----------
+    records: iterable
+    (header line, sequence) tuples, ORFs of a transcript need to be
+    consecutive
+    summary: SummaryWriter
+    Writer that receives the summary rows of all ORFs
+    top, per_sense:
+    See find_longest_orfs
+
+    Returns
+    -------
+    Generator of (header line, sequence) tuples of the longest ORFs
+    """
+    for seqID, group in iter_transcripts(records):
+        orfs, selected = find_longest_orfs(group, top, per_sense)
+        summary.add(orfs, {i for length, i, line, seq in selected})
+        for length, i, line, seq in selected:
+            yield line, seq
+
+
+def get_longest_orfs(records, fasta_handle, summary, top=1, per_sense=False):
+    """
+    Write the longest ORF per transcript and the ORF summary table.
+
+    Parameters
+    ----------
+    records: iterable
+    (header line, sequence) tuples as returned by read_fasta, ORFs of a
+    transcript need to be consecutive
+    fasta_handle: file
+    Open text handle for the FASTA file with the longest ORFs
+    summary: SummaryWriter or ArrowSummaryWriter
+    Writer for the ORF summary table
+    top, per_sense:
+    See find_longest_orfs
+    """
+    separator = ""
+    for line, seq in longest_orfs(records, summary, top, per_sense):
+        fasta_handle.write(separator + line + "\n" + seq)
+        separator = "\n"
+    summary.flush()
+
+
+def build_index(path, index_handle):
+    """
+    Write a samtools faidx compatible index of a FASTA file.
+
+    The columns are name, sequence length, byte offset of the sequence,
+    bases per line and bytes per line.
+    """
+    def write_entry():
+        index_handle.write(f"{name}\t{length}\t{seq_offset}\t{linebases or length}\t{linewidth or length + 1}\n")
+
+    name = None
+    offset = 0
+    with open(path, "rb", buffering=IO_BUFFER_SIZE) as handle:
+        for line in handle:
+            if line.startswith(b">"):
+                if name is not None:
+                    write_entry()
+                name = line[1:].split(maxsplit=1)[0].decode()
+                seq_offset = offset + len(line)
+                length = 0
+                linebases = linewidth = None
+                last_line = False
+            elif name is not None:
+                bases = len(line.rstrip(b"\r\n"))
+                if last_line and bases > 0:
+                    raise ValueError(f"Can not index {path}: different line length in sequence '{name}'")
+                if linebases is None:
+                    linebases = bases
+                    linewidth = len(line)
+                elif bases > linebases:
+                    raise ValueError(f"Can not index {path}: different line length in sequence '{name}'")
+                last_line = bases < linebases
+                length += bases
+            offset += len(line)
+    if name is not None:
+        write_entry()
+
+
+@contextlib.contextmanager
+def open_index(path):
+    """
+    Open the .fai index of a FASTA file.
+
+    An existing index that is newer than the FASTA file is reused, otherwise
+    the index is built and saved next to the FASTA file or, if that is not
+    possible, in a temporary file.
+    """
+    index_path = f"{path}.fai"
+    if os.path.exists(index_path) and os.path.getmtime(index_path) >= os.path.getmtime(path):
+        with open(index_path) as index_handle:
+            yield index_handle
+        return
+    try:
+        tmp_handle = tempfile.NamedTemporaryFile("w+", dir=os.path.dirname(os.path.abspath(path)), delete=False)
+    except OSError:
+        with tempfile.TemporaryFile("w+") as index_handle:
+            build_index(path, index_handle)
+            index_handle.seek(0)
+            yield index_handle
+        return
+    try:
+        with tmp_handle:
+            build_index(path, tmp_handle)
+        os.replace(tmp_handle.name, index_path)
+    except BaseException:
+        os.remove(tmp_handle.name)
+        raise
+    with open(index_path) as index_handle:
+        yield index_handle
+
+
+def read_indexed_fasta(data, index_handle):
+    """
+    Iterate over the records of a memory-mapped FASTA file using its index.
+
+    Only the header lines are decoded, the sequences are returned as
+    (offset, number of bytes) ranges of `data`.
+
+    Returns
+    -------
+    Generator of (header line, (offset, number of bytes)) tuples
+    """
+    for entry in index_handle:
+        name, length, offset, linebases, linewidth = entry.split("\t")
+        length = int(length)
+        offset = int(offset)
+        linebases = int(linebases)
+        # number of bytes of the sequence including line breaks
+        lines = (length - 1) // linebases if length > 0 else 0
+        span = lines * int(linewidth) + length - lines * linebases
+        line = data[data.rfind(b">", 0, offset):offset].decode().strip()
+        yield line, (offset, span)
+
+
+def get_longest_orfs_indexed(path, fasta_handle, summary, top=1, per_sense=False):
+    """
+    Write the longest ORF per transcript and the ORF summary table using a
+    .fai index of the input.
+
+    The input is memory-mapped and only the bytes of the longest ORFs are
+    copied to the output, the other sequences are never decoded.
+
+    Parameters
+    ----------
+    path: str
+    Path of the ORF FASTA file, ORFs of a transcript need to be consecutive
+    fasta_handle: file
+    Open binary handle for the FASTA file with the longest ORFs
+    summary: SummaryWriter or ArrowSummaryWriter
+    Writer for the ORF summary table
+    top, per_sense:
+    See find_longest_orfs
+    """
+    if os.path.getsize(path) == 0:
+        return
+    with open(path, "rb") as handle, \
+            mmap.mmap(handle.fileno(), 0, access=mmap.ACCESS_READ) as data, \
+            open_index(path) as index_handle:
+        separator = b""
+        for line, (offset, span) in longest_orfs(read_indexed_fasta(data, index_handle), summary, top, per_sense):
+            fasta_handle.write(separator + line.encode() + b"\n")
+            fasta_handle.write(data[offset:offset + span].translate(None, b"\r\n\t "))
+            separator = b"\n"
+    summary.flush()
+
+
+def chunk_boundaries(path, chunks):
+    """
+    Split a FASTA file into byte ranges at transcript boundaries.
+
+    Each boundary is moved forward to the first header whose seqID differs
+    from the seqID found at the approximate split position, so that all
+    ORFs of a transcript end up in the same chunk.
+
+    Returns
+    -------
+    List of (start, end) byte offsets
+    """
+    size = os.path.getsize(path)
+    offsets = [0]
+    with open(path, "rb") as handle:
+        for i in range(1, chunks):
+            position = max(size * i // chunks, offsets[-1])
+            handle.seek(position)
+            if position > 0:
+                # skip the (possibly partial) line at the split position
+                position += len(handle.readline())
+            seqID = None
+            for line in handle:
+                if line.startswith(b">"):
+                    current = parse_header(line.decode().strip())[0]
+                    if seqID is None:
+                        seqID = current
+                    elif current != seqID:
+                        break
+                position += len(line)
+            if position >= size:
+                break
+            if position > offsets[-1]:
+                offsets.append(position)
+    offsets.append(size)
+    return list(zip(offsets[:-1], offsets[1:]))
+
+
+def read_chunk(path, start, end):
+    """
+    Iterate over the lines of a byte range of a file.
+    """
+    with open(path, "rb", buffering=IO_BUFFER_SIZE) as handle:
+        handle.seek(start)
+        position = start
+        for line in handle:
+            if position >= end:
+                break
+            position += len(line)
+            yield line.decode()
+
+
+def process_chunk(path, start, end, fasta_path, summary_path, top, per_sense):
+    """
+    Worker function: get the longest ORFs of one chunk of the input.
+    """
+    with open(fasta_path, "w", buffering=IO_BUFFER_SIZE) as fasta_handle, \
+            open(summary_path, "w", buffering=IO_BUFFER_SIZE) as summary_handle:
+        summary = SummaryWriter(summary_handle, header=False)
+        get_longest_orfs(read_fasta(read_chunk(path, start, end)), fasta_handle, summary, top, per_sense)
+
+
+def get_longest_orfs_parallel(path, fasta_handle, summary, threads, top=1, per_sense=False):
+    """
+    Write the longest ORF per transcript and the ORF summary table using
+    several worker processes.
+
+    The input is split at transcript boundaries, the chunks are processed
+    independently and the outputs are merged in the original order.
+
+    Parameters
+    ----------
+    path: str
+    Path of the ORF FASTA file, ORFs of a transcript need to be consecutive
+    fasta_handle: file
+    Open text handle for the FASTA file with the longest ORFs
+    summary: SummaryWriter or ArrowSummaryWriter
+    Writer for the ORF summary table
+    threads: int
+    Number of worker processes
+    top, per_sense:
+    See find_longest_orfs
+    """
+    chunks = chunk_boundaries(path, threads * CHUNKS_PER_THREAD)
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        jobs = [
+            (path, start, end, os.path.join(tmp_dir, f"{i}.fasta"), os.path.join(tmp_dir, f"{i}.tab"), top, per_sense)
+            for i, (start, end) in enumerate(chunks)
+        ]
+        with multiprocessing.Pool(threads) as pool:
+            pool.starmap(process_chunk, jobs)
+        merge_outputs([job[3:5] for job in jobs], fasta_handle, summary)
+
+
+def merge_outputs(outputs, fasta_handle, summary):
+    """
+    Concatenate the FASTA and summary files of independently processed
+    parts of the input.
+
+    Parameters
+    ----------
+    outputs: list
+    (FASTA path, summary path) tuples in output order, the summary files
+    are tabular without header line
+    """
+    separator = ""
+    for fasta_path, summary_path in outputs:
+        if os.path.getsize(fasta_path) > 0:
+            fasta_handle.write(separator)
+            separator = "\n"
+            with open(fasta_path) as part_handle:
+                shutil.copyfileobj(part_handle, fasta_handle, IO_BUFFER_SIZE)
+        with open(summary_path) as part_handle:
+            summary.add_tabular(part_handle)
+
+
+def partition_records(records, tmp_dir, partitions):
+    """
+    Spill FASTA records to temporary files, hash-partitioned by transcript.
+
+    All ORFs of a transcript end up in the same partition, in input order.
+
+    Returns
+    -------
+    List of the paths of the partition files
+    """
+    paths = [os.path.join(tmp_dir, f"partition_{i}.fasta") for i in range(partitions)]
+    with contextlib.ExitStack() as stack:
+        handles = [stack.enter_context(open(path, "w", buffering=IO_BUFFER_SIZE // 16)) for path in paths]
+        for line, seq in records:
+            seqID = parse_header(line)[0]
+            handles[zlib.crc32(seqID.encode()) % partitions].write(line + "\n" + seq + "\n")
+    return paths
+
+
+def group_records(records):
+    """
+    Reorder FASTA records such that the ORFs of each transcript are
+    consecutive. Transcripts are kept in the order of their first ORF.
+    """
+    groups = {}
+    for line, seq in records:
+        groups.setdefault(parse_header(line)[0], []).append((line, seq))
+    for group in groups.values():
+        yield from group
+
+
+def read_partitions(paths):
+    """
+    Iterate over the records of partition files, grouped by transcript.
+    """
+    for path in paths:
+        with open(path, buffering=IO_BUFFER_SIZE) as handle:
+            yield from group_records(read_fasta(handle))
+
+
+def reduce_partition(partition_path, fasta_path, summary_path, top, per_sense):
+    """
+    Worker function: get the longest ORFs of one partition of the input.
+    """
+    with open(fasta_path, "w", buffering=IO_BUFFER_SIZE) as fasta_handle, \
+            open(summary_path, "w", buffering=IO_BUFFER_SIZE) as summary_handle:
+        summary = SummaryWriter(summary_handle, header=False)
+        get_longest_orfs(read_partitions([partition_path]), fasta_handle, summary, top, per_sense)
+
+
+def get_longest_orfs_unsorted(records, fasta_handle, summary, partitions, threads=1, top=1, per_sense=False):
+    """
+    Write the longest ORF per transcript and the ORF summary table for input
+    in which the ORFs of a transcript are not consecutive.
+
+    The records are hash-partitioned by transcript into temporary files and
+    each partition is reduced separately, so memory use is bounded by the
+    size of the largest partition. The outputs are ordered by partition and
+    not by input order.
+
+    Parameters
+    ----------
+    records: iterable
+    (header line, sequence) tuples as returned by read_fasta
+    fasta_handle: file
+    Open text handle for the FASTA file with the longest ORFs
+    summary: SummaryWriter or ArrowSummaryWriter
+    Writer for the ORF summary table
+    partitions: int
+    Number of partitions
+    threads: int
+    Number of worker processes used to reduce the partitions
+    top, per_sense:
+    See find_longest_orfs
+    """
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        paths = partition_records(records, tmp_dir, partitions)
+        if threads > 1:
+            jobs = [(path, f"{path}.out.fasta", f"{path}.out.tab", top, per_sense) for path in paths]
+            with multiprocessing.Pool(threads) as pool:
+                pool.starmap(reduce_partition, jobs)
+            merge_outputs([job[1:3] for job in jobs], fasta_handle, summary)
+        else:
+            get_longest_orfs(read_partitions(paths), fasta_handle, summary, top, per_sense)
+
+
+def compression(path):
+    """
+    Detect the compression of a file from its first bytes.
+
+    Returns
+    -------
+    "gzip" (also for bgzip), "zstd" or None for uncompressed files
+    """
+    with open(path, "rb") as handle:
+        magic = handle.read(4)
+    if magic.startswith(GZIP_MAGIC):
+        return "gzip"
+    if magic.startswith(ZSTD_MAGIC):
+        return "zstd"
+    return None
+
+
+def require_zstandard():
+    if zstandard is None:
+        raise RuntimeError("zstd compressed files need the zstandard package")
+
+
+def read_decompressed(raw):
+    """
+    Iterate over the lines of a decompressing binary stream.
+
+    Reading and decompressing runs in a separate thread that passes blocks
+    of data through a bounded queue, so that decompression overlaps with
+    parsing.
+    """
+    blocks = queue.Queue(maxsize=DECOMPRESS_QUEUE_SIZE)
+
+    def decompress():
+        try:
+            while True:
+                block = raw.read(IO_BUFFER_SIZE)
+                blocks.put(block)
+                if not block:
+                    break
+        except Exception as e:
+            blocks.put(e)
+
+    threading.Thread(target=decompress, daemon=True).start()
+    decoder = codecs.getincrementaldecoder("utf-8")()
+    rest = ""
+    while True:
+        block = blocks.get()
+        if isinstance(block, Exception):
+            raise block
+        lines = (rest + decoder.decode(block, final=not block)).split("\n")
+        rest = lines.pop()
+        yield from lines
+        if not block:
+            break
+    if rest:
+        yield rest
+
+
+@contextlib.contextmanager
+def open_input(path):
+    """
+    Open a plain, gzip/bgzip or zstd compressed text file for reading.
+
+    Returns
+    -------
+    Iterable of the lines of the file
+    """
+    kind = compression(path)
+    if kind is None:
+        with open(path, buffering=IO_BUFFER_SIZE) as handle:
+            yield handle
+    elif kind == "gzip":
+        with gzip.open(path, "rb") as raw:
+            yield read_decompressed(raw)
+    else:
+        require_zstandard()
+        with open(path, "rb") as handle, \
+                zstandard.ZstdDecompressor().stream_reader(handle) as raw:
+            yield read_decompressed(raw)
+
+
+def open_output(path, mode="w"):
+    """
+    Open an output file, compressed with gzip for the suffix .gz and with
+    zstd for the suffix .zst.
+    """
+    if path.endswith(".gz"):
+        return gzip.open(path, mode if "b" in mode else "wt", compresslevel=6)
+    if path.endswith(".zst"):
+        require_zstandard()
+        raw = zstandard.ZstdCompressor().stream_writer(open(path, "wb"))
+        return raw if "b" in mode else io.TextIOWrapper(raw)
+    return open(path, mode, buffering=IO_BUFFER_SIZE)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Obtain the longest ORF per transcript from six-frame translations.")
+    parser.add_argument("input", help="ORF FASTA file, e.g. the output of EMBOSS getorf, optionally gzip, bgzip or zstd compressed")
+    parser.add_argument("output_fasta", help="FASTA file with the longest ORF per transcript, compressed if the name ends with .gz or .zst")
+    parser.add_argument("output_summary", help="Table with information about all ORFs, compressed if the name ends with .gz or .zst")
+    parser.add_argument("--threads", type=int, default=1, help="Number of worker processes, sorted compressed input is processed in a single process")
+    parser.add_argument("--index", action="store_true", help="Use (and if necessary create) a .fai index of the input and copy the longest ORFs directly from the memory-mapped input")
+    parser.add_argument("--unsorted", action="store_true", help="Input in which the ORFs of a transcript are not consecutive, e.g. merged outputs of several ORF callers")
+    parser.add_argument("--partitions", type=int, default=DEFAULT_PARTITIONS, help="Number of temporary partitions used for unsorted input")
+    parser.add_argument("--top", type=int, default=1, help="Number of longest ORFs to report per transcript")
+    parser.add_argument("--per-sense", action="store_true", help="Report the longest ORFs separately for normal and reverse sense ORFs")
+    parser.add_argument("--summary-format", choices=SUMMARY_FORMATS, default="tabular", help="File format of the ORF summary table, parquet and arrow need pyarrow")
+    args = parser.parse_args()
+    if args.threads < 1:
+        parser.error("--threads needs to be at least 1")
+    if args.top < 1:
+        parser.error("--top needs to be at least 1")
+    if args.partitions < 1:
+        parser.error("--partitions needs to be at least 1")
+    if args.index and args.threads > 1:
+        parser.error("--index can not be combined with --threads")
+    if args.index and args.unsorted:
+        parser.error("--index can not be combined with --unsorted")
+    compressed = compression(args.input) is not None
+    if args.index and compressed:
+        parser.error("--index needs an uncompressed input")
+
+    fasta_mode = "wb" if args.index else "w"
+    with open_output(args.output_fasta, fasta_mode) as fasta_handle, \
+            open_summary(args.output_summary, args.summary_format) as summary:
+        if args.index:
+            get_longest_orfs_indexed(args.input, fasta_handle, summary, args.top, args.per_sense)
+        elif args.unsorted:
+            with open_input(args.input) as input_handle:
+                get_longest_orfs_unsorted(read_fasta(input_handle), fasta_handle, summary, args.partitions, args.threads, args.top, args.per_sense)
+        elif args.threads > 1 and not compressed:
+            get_longest_orfs_parallel(args.input, fasta_handle, summary, args.threads, args.top, args.per_sense)
+        else:
+            with open_input(args.input) as input_handle:
+                get_longest_orfs(read_fasta(input_handle), fasta_handle, summary, args.top, args.per_sense)
+
+
+if __name__ == "__main__":
+    main()
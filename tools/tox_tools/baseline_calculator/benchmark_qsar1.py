@@ -0,0 +1,167 @@
+#!/usr/bin/env python
+
+# benchmark for qsar1.py (not part of the Galaxy tool)
+#
+# run both functions on synthetic inputs of increasing size:
+#   python benchmark_qsar1.py --compounds 10000 100000 1000000 --equations 10 100
+# compare command line variants, e.g. the chunked mode:
+#   python benchmark_qsar1.py --variant= --variant="--chunksize 100000"
+
+import argparse
+import math
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import time
+
+SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "qsar1.py")
+TEST_DATA = os.path.join(os.path.dirname(os.path.abspath(__file__)), "test-data")
+
+
+def generate_compounds(path, compounds, rng):
+    """
+    Write a synthetic logD input with values from -3 to 9.
+
+    Parameters
+    ----------
+    path: str
+    Path of the csv file
+    compounds: int
+    Number of rows
+    rng: random.Random
+    Random number generator
+    """
+    with open(path, "w") as handle:
+        handle.write("logD\n")
+        for _ in range(compounds):
+            handle.write(f"{rng.uniform(-3, 9):.3f}\n")
+
+
+def generate_equations(path, equations, rng):
+    """
+    Write a synthetic table of linear functions in the format 'ax+b' or 'ax-b'.
+
+    Parameters
+    ----------
+    path: str
+    Path of the csv file
+    equations: int
+    Number of functions
+    rng: random.Random
+    Random number generator
+    """
+    with open(path, "w") as handle:
+        handle.write("function\n")
+        for _ in range(equations):
+            handle.write(f"{rng.uniform(0.1, 2):.2f}x{rng.randint(-5, 5):+d}\n")
+
+
+def run_tool(arguments, variant, output_path):
+    """
+    Run qsar1.py in a subprocess.
+
+    Returns
+    -------
+    Tuple (wall time in seconds, peak RSS in MB)
+    """
+    command = [sys.executable, SCRIPT, *arguments, "--output", output_path, *variant.split()]
+    start = time.perf_counter()
+    process = subprocess.Popen(command)
+    _, status, rusage = os.wait4(process.pid, 0)
+    elapsed = time.perf_counter() - start
+    returncode = os.waitstatus_to_exitcode(status)
+    if returncode != 0:
+        raise subprocess.CalledProcessError(returncode, command)
+    # ru_maxrss is in kB on Linux
+    return elapsed, rusage.ru_maxrss / 1024
+
+
+def same_values(path, expected_path):
+    """
+    Compare two csv files, numbers are compared with a relative tolerance
+    since the last digit can differ between numpy builds.
+    """
+    with open(path) as handle, open(expected_path) as expected_handle:
+        lines = handle.read().splitlines()
+        expected = expected_handle.read().splitlines()
+    if len(lines) != len(expected):
+        return False
+    for line, expected_line in zip(lines, expected):
+        fields, expected_fields = line.split(","), expected_line.split(",")
+        if len(fields) != len(expected_fields):
+            return False
+        for field, expected_field in zip(fields, expected_fields):
+            if field == expected_field:
+                continue
+            try:
+                if not math.isclose(float(field), float(expected_field), rel_tol=1e-12):
+                    return False
+            except ValueError:
+                return False
+    return True
+
+
+def check(variants):
+    """
+    Verify every variant against the expected outputs of the tool tests.
+    """
+    tests = [
+        (["--function", "calculate_baseline", "--csv_input", os.path.join(TEST_DATA, "qsar.tabular")], "qsar_result.tsv"),
+        (["--function", "apply_linear_functions", "--csv_input", os.path.join(TEST_DATA, "qsar.tabular"),
+          "--functions_csv", os.path.join(TEST_DATA, "functions.tabular")], "qsar_result_2.tsv"),
+    ]
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        output_path = os.path.join(tmp_dir, "output.csv")
+        for variant in variants:
+            for arguments, expected in tests:
+                run_tool(arguments, variant, output_path)
+                if not same_values(output_path, os.path.join(TEST_DATA, expected)):
+                    raise SystemExit(f"variant '{variant}' does not reproduce {expected}")
+
+
+def benchmark(compound_sizes, equation_sizes, variants, repeat, seed):
+    """
+    Print the run time and peak memory of both functions as a table.
+    """
+    rng = random.Random(seed)
+    print("function\tcompounds\tequations\tvariant\tseconds\tcompounds/s\tpeak_rss_MB")
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        output_path = os.path.join(tmp_dir, "output.csv")
+        for compounds in compound_sizes:
+            input_path = os.path.join(tmp_dir, f"logd_{compounds}.csv")
+            generate_compounds(input_path, compounds, rng)
+            cases = [("calculate_baseline", "-", ["--function", "calculate_baseline", "--csv_input", input_path])]
+            for equations in equation_sizes:
+                functions_path = os.path.join(tmp_dir, f"functions_{equations}.csv")
+                if not os.path.exists(functions_path):
+                    generate_equations(functions_path, equations, rng)
+                cases.append(("apply_linear_functions", equations, ["--function", "apply_linear_functions",
+                                                                    "--csv_input", input_path, "--functions_csv", functions_path]))
+            for function, equations, arguments in cases:
+                for variant in variants:
+                    runs = [run_tool(arguments, variant, output_path) for _ in range(repeat)]
+                    elapsed = min(run[0] for run in runs)
+                    peak_rss = max(run[1] for run in runs)
+                    print(f"{function}\t{compounds}\t{equations}\t{variant or '(default)'}\t{elapsed:.3f}\t{compounds / elapsed:.0f}\t{peak_rss:.1f}", flush=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark qsar1.py on synthetic logD inputs and equation tables.")
+    parser.add_argument("--compounds", type=int, nargs="+", default=[1000, 10000, 100000], help="Numbers of compounds (rows of the logD input)")
+    parser.add_argument("--equations", type=int, nargs="+", default=[10, 100], help="Numbers of linear functions for apply_linear_functions")
+    parser.add_argument("--variant", action="append", help="Command line options of qsar1.py to benchmark, can be repeated (default: no options)")
+    parser.add_argument("--repeat", type=int, default=3, help="Number of runs per case, the fastest run is reported")
+    parser.add_argument("--seed", type=int, default=0, help="Seed of the random number generator")
+    parser.add_argument("--no-check", action="store_true", help="Do not verify the variants on the test data first")
+    args = parser.parse_args()
+
+    variants = args.variant or [""]
+    if not args.no_check:
+        check(variants)
+    benchmark(args.compounds, args.equations, variants, args.repeat, args.seed)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,39 +1,192 @@
 import argparse
+import contextlib
+import os
 import re
 
+import numpy as np
 import pandas as pd
 
-parser = argparse.ArgumentParser(description='Calculate baseline toxicity for different aquatic species')
-parser.add_argument('--function', type=str, choices=['calculate_baseline', 'apply_linear_functions'],
-                    help='Function to execute')
-parser.add_argument('--csv_input', type=argparse.FileType('r'), help='Path to the input csv file')
-parser.add_argument('--functions_csv', type=argparse.FileType('r'), default=None,
-                    help='Path to the csv file containing functions (only for apply_linear_functions)')
-parser.add_argument('--output', type=argparse.FileType('w'), help='Path for the output csv file')
-args = parser.parse_args()
-
-if args.function == 'calculate_baseline':
-    df = pd.read_csv(args.csv_input)
+# linear function in the format 'ax+b' or 'ax-b'
+EQUATION_RE = re.compile(r'([+-]?\d*\.?\d*)x([+-]\d+)?')
+
+# table of the pre-defined species models (columns species, model, slope, intercept)
+MODELS_CSV = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'species_models.csv')
+# constant term of the cells model
+CELLS_CONSTANT = 10 ** 3 * 0.07 * 0.001
+
+
+def linear_model(x, slope, intercept):
+    # log(1/EC50) = slope * logD + intercept, one column per species
+    return 10 ** (-(np.multiply.outer(x, slope) + intercept))
+
+
+def cells_model(x, slope, intercept):
+    # non-linear baseline model for cells, one column per species
+    return 0.026 / (10 ** x)[:, np.newaxis] * (1 + 10 ** (np.multiply.outer(x, slope) + intercept) * 3 * 0.001 + CELLS_CONSTANT)
+
+
+# model types that can be used in the species table
+MODEL_TYPES = {
+    'linear': linear_model,
+    'cells': cells_model,
+}
+
+
+def read_models(path=MODELS_CSV):
+    models = pd.read_csv(path)
+    unknown = set(models['model']) - set(MODEL_TYPES)
+    if unknown:
+        raise ValueError(f"Unknown model type(s) {', '.join(sorted(unknown))}, choose from {', '.join(MODEL_TYPES)}")
+    return models.reset_index(drop=True)
+
+
+def calculate_baseline(df, models=None):
+    if models is None:
+        models = read_models()
     df.iloc[:, 0] = df.iloc[:, 0].astype(int)
-    df['Caenorhabditis elegans [mol/L]'] = 10 ** (-(0.81 * df.iloc[:, 0] + 1.15))
-    df['Daphia magna [mol/L]'] = 10 ** (-(0.82 * df.iloc[:, 0] + 1.48))
-    df['Danio rerio [mol/L]'] = 10 ** (-(0.99 * df.iloc[:, 0] + 0.78))
-    df['Generic Human Cells [mol/L]'] = 0.026 / (10 ** df.iloc[:, 0]) * (1 + 10 ** (0.7 * df.iloc[:, 0] + 0.34) * 3 * 0.001 + 10 ** 3 * 0.07 * 0.001)
-    df.to_csv(args.output, index=False)
-
-elif args.function == 'apply_linear_functions':
-    df = pd.read_csv(args.csv_input)
-    functions_df = pd.read_csv(args.functions_csv)
-
-    def parse_and_apply_equation(equation, x_values):
-        # Extract 'a' and 'b' from the equation  (assuming the format 'ax+b' or 'ax-b')
-        pattern = re.compile(r'([+-]?\d*\.?\d*)x([+-]\d+)?')
-        match = pattern.search(equation)
-        a = float(match.group(1)) if match.group(1) not in ('', '+', '-') else 1.0
-        b = float(match.group(2)) if match.group(2) else 0
-        return a * x_values + b
-
-    for i, row in functions_df.iterrows():
-        func = row['function']
-        df[f'result_{i}'] = parse_and_apply_equation(func, df['logD'])
-    df.to_csv(args.output, index=False)
+    x = df.iloc[:, 0].to_numpy(dtype=float)
+    # (compounds x species) matrix, each model type is evaluated for all of its species at once
+    results = np.empty((len(x), len(models)))
+    for model, group in models.groupby('model', sort=False):
+        results[:, group.index] = MODEL_TYPES[model](x, group['slope'].to_numpy(dtype=float), group['intercept'].to_numpy(dtype=float))
+    results = pd.DataFrame(results, index=df.index, columns=models['species'].tolist())
+    return pd.concat([df, results], axis=1)
+
+
+def parse_equations(equations):
+    # Extract 'a' and 'b' from all equations once (assuming the format 'ax+b' or 'ax-b')
+    a = np.empty(len(equations))
+    b = np.empty(len(equations))
+    for i, equation in enumerate(equations):
+        match = EQUATION_RE.search(equation)
+        a[i] = float(match.group(1)) if match.group(1) not in ('', '+', '-') else 1.0
+        b[i] = float(match.group(2)) if match.group(2) else 0
+    return a, b
+
+
+def apply_linear_functions(df, functions_df):
+    a, b = parse_equations(functions_df['function'])
+    # one column per function: a * logD + b for all compounds at once
+    results = np.multiply.outer(df['logD'].to_numpy(dtype=float), a) + b
+    results = pd.DataFrame(results, index=df.index, columns=[f'result_{i}' for i in functions_df.index])
+    return pd.concat([df, results], axis=1)
+
+
+def normalize_chunk(chunk, function):
+    # calculate_baseline gets the first column of every block as float, otherwise
+    # its format in the output would depend on the values in the block (2 or 2.0),
+    # the other functions get the columns as read
+    if function is calculate_baseline:
+        chunk[chunk.columns[0]] = chunk.iloc[:, 0].astype(float)
+    return chunk
+
+
+def process_chunks(csv_input, output, chunksize, function, *args):
+    # process the input in blocks of rows and append each block to the output
+    header = True
+    for chunk in pd.read_csv(csv_input, chunksize=chunksize):
+        function(normalize_chunk(chunk, function), *args).to_csv(output, index=False, header=header)
+        header = False
+
+
+def parse_operation(operation):
+    # 'calculate_baseline[:models.csv]' or 'apply_linear_functions:functions.csv'
+    name, _, path = operation.partition(':')
+    if name == 'calculate_baseline':
+        return name, calculate_baseline, (read_models(path or MODELS_CSV),)
+    elif name == 'apply_linear_functions':
+        if not path:
+            raise ValueError(f"Operation '{operation}' needs a functions csv file (apply_linear_functions:path)")
+        return name, apply_linear_functions, (pd.read_csv(path),)
+    raise ValueError(f"Unknown operation '{operation}', choose from calculate_baseline, apply_linear_functions")
+
+
+def combine_results(df, results, functions):
+    # input columns once followed by the new columns of all operations,
+    # calculate_baseline also adds the truncated first column its results are based on,
+    # column names that are already used get the number of the operation as suffix
+    combined = [df]
+    columns = set(df.columns)
+    for k, (result, function) in enumerate(zip(results, functions), start=1):
+        new = result.iloc[:, len(df.columns):]
+        if function is calculate_baseline:
+            new = pd.concat([result.iloc[:, :1], new], axis=1)
+        new = new.rename(columns={column: f'{column}_{k}' for column in new.columns if column in columns})
+        columns.update(new.columns)
+        combined.append(new)
+    return pd.concat(combined, axis=1)
+
+
+def process_batch(csv_input, operations, output=None, output_dir=None, chunksize=None):
+    # read the input once (or block by block) and apply all operations to it, the
+    # results are written to one combined output or to one file per operation
+    if chunksize:
+        chunks = pd.read_csv(csv_input, chunksize=chunksize)
+    else:
+        chunks = [pd.read_csv(csv_input)]
+    with contextlib.ExitStack() as stack:
+        if output_dir:
+            handles = [stack.enter_context(open(os.path.join(output_dir, f'{k}_{name}.csv'), 'w'))
+                       for k, (name, _, _) in enumerate(operations, start=1)]
+        header = True
+        for chunk in chunks:
+            results = []
+            for _, function, args in operations:
+                # operations get a copy since calculate_baseline modifies the input
+                operation_chunk = chunk.copy()
+                if chunksize:
+                    operation_chunk = normalize_chunk(operation_chunk, function)
+                results.append(function(operation_chunk, *args))
+            if output_dir:
+                for handle, result in zip(handles, results):
+                    result.to_csv(handle, index=False, header=header)
+            else:
+                combine_results(chunk, results, [function for _, function, _ in operations]).to_csv(output, index=False, header=header)
+            header = False
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Calculate baseline toxicity for different aquatic species')
+    parser.add_argument('--function', type=str, choices=['calculate_baseline', 'apply_linear_functions', 'batch'],
+                        help='Function to execute')
+    parser.add_argument('--csv_input', type=argparse.FileType('r'), help='Path to the input csv file')
+    parser.add_argument('--functions_csv', type=argparse.FileType('r'), default=None,
+                        help='Path to the csv file containing functions (only for apply_linear_functions)')
+    parser.add_argument('--output', type=argparse.FileType('w'), help='Path for the output csv file')
+    parser.add_argument('--models', type=str, default=MODELS_CSV,
+                        help='Path to the csv file containing the species models (only for calculate_baseline)')
+    parser.add_argument('--operation', type=str, action='append', default=[],
+                        help='Operation of the batch function: calculate_baseline[:models.csv] or apply_linear_functions:functions.csv, can be repeated')
+    parser.add_argument('--output_dir', type=str, default=None,
+                        help='Write the result of every operation of the batch function to a separate csv file in this directory')
+    parser.add_argument('--chunksize', type=int, default=None,
+                        help='Process the input in blocks of this many rows to keep the memory usage constant')
+    args = parser.parse_args()
+
+    if args.function == 'calculate_baseline':
+        models = read_models(args.models)
+        if args.chunksize:
+            process_chunks(args.csv_input, args.output, args.chunksize, calculate_baseline, models)
+        else:
+            df = pd.read_csv(args.csv_input)
+            calculate_baseline(df, models).to_csv(args.output, index=False)
+
+    elif args.function == 'apply_linear_functions':
+        functions_df = pd.read_csv(args.functions_csv)
+        if args.chunksize:
+            process_chunks(args.csv_input, args.output, args.chunksize, apply_linear_functions, functions_df)
+        else:
+            df = pd.read_csv(args.csv_input)
+            apply_linear_functions(df, functions_df).to_csv(args.output, index=False)
+
+    elif args.function == 'batch':
+        if not args.operation:
+            parser.error('batch needs at least one --operation')
+        if not (args.output or args.output_dir):
+            parser.error('batch needs --output or --output_dir')
+        operations = [parse_operation(operation) for operation in args.operation]
+        process_batch(args.csv_input, operations, args.output, args.output_dir, args.chunksize)
+
+
+if __name__ == '__main__':
+    main()
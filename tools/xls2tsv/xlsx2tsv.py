@@ -1,14 +1,138 @@
 import argparse
+import csv
+import datetime
+import functools
+import multiprocessing
+import posixpath
+import xml.etree.ElementTree as ET
+import zipfile
 
+import openpyxl
 import pandas as pd
 
+XLSX_NS = {
+    "main": "http://schemas.openxmlformats.org/spreadsheetml/2006/main",
+    "rel": "http://schemas.openxmlformats.org/package/2006/relationships",
+}
+XLSX_REL_ID = "{http://schemas.openxmlformats.org/officeDocument/2006/relationships}id"
+
+OUTPUT_FORMATS = ("tsv", "parquet", "feather")
+# rows per chunk written by DataFrame.to_csv
+CHUNK_SIZE = 50000
+# string columns with at most this share of distinct values become categoricals
+CATEGORY_RATIO = 0.5
+
+# workbook opened once per worker process of convert_xlsx_to_tsv_parallel
+_worker_workbook = None
+
+
+def parse_sheet_selection(sheet_selection: str, sheet_names: list):
+    """
+    Resolve the sheet selection against the sheets of a workbook.
+
+    Parameters
+    ----------
+    sheet_selection: str
+    Comma-separated list of sheet names, a single sheet name (which may
+    contain commas) or None for all sheets
+    sheet_names: list
+    Names of the sheets of the workbook
+
+    Returns
+    -------
+    List of the selected sheet names
+    """
+    if sheet_selection is None:
+        return list(sheet_names)
+    if sheet_selection in sheet_names:
+        return [sheet_selection]
+    selection = [name.strip() for name in sheet_selection.split(",") if name.strip()]
+    missing = [name for name in selection if name not in sheet_names]
+    if missing:
+        raise ValueError(f"Worksheet(s) {', '.join(missing)} not found")
+    return selection
+
+
+def infer_dtypes(df: pd.DataFrame):
+    """
+    Assign explicit dtypes to the columns of a sheet.
+
+    Object columns holding only numbers become numeric, columns holding only
+    dates become datetime and string columns with few distinct values become
+    categorical. Float columns holding only whole numbers become nullable
+    integers.
+
+    Parameters
+    ----------
+    df: pd.DataFrame
+    Sheet as read by pandas
+
+    Returns
+    -------
+    DataFrame with the converted columns
+    """
+    columns = {}
+    for column in df.columns:
+        series = df[column]
+        values = series.dropna()
+        if (pd.api.types.is_object_dtype(series) or pd.api.types.is_string_dtype(series)) and not values.empty:
+            kinds = set(values.map(type))
+            if kinds <= {int, float, bool} and bool not in kinds:
+                series = pd.to_numeric(series)
+            elif kinds <= {datetime.datetime, datetime.date, pd.Timestamp}:
+                series = pd.to_datetime(series)
+            elif kinds == {str} and values.nunique() <= CATEGORY_RATIO * len(values):
+                series = series.astype("category")
+            else:
+                series = series.astype("string")
+        if pd.api.types.is_float_dtype(series) and not values.empty and (series.dropna() % 1 == 0).all():
+            series = series.astype("Int64")
+        columns[column] = series
+    return pd.DataFrame(columns, index=df.index)
+
+
+def write_sheet(df: pd.DataFrame,
+                out_dir: str,
+                sheet_name: str,
+                output_format: str = "tsv",
+                infer_types: bool = False):
+    """
+    Write a sheet as TSV (in chunks of CHUNK_SIZE rows), Parquet or Feather file.
+
+    Parameters
+    ----------
+    df: pd.DataFrame
+    Sheet as read by pandas
+    out_dir: str
+    Path to the output dir
+    sheet_name: str
+    Name of the sheet, used as file name
+    output_format: str
+    One of OUTPUT_FORMATS
+    infer_types: bool
+    Assign explicit dtypes before writing, always done for Parquet and Feather
+    """
+    if infer_types or output_format != "tsv":
+        df = infer_dtypes(df)
+    if output_format == "parquet":
+        # column names need to be strings for Parquet and Feather
+        df.rename(columns=str).to_parquet(f"{out_dir}/{sheet_name}.parquet", index=False)
+    elif output_format == "feather":
+        df.rename(columns=str).reset_index(drop=True).to_feather(f"{out_dir}/{sheet_name}.feather")
+    else:
+        df.to_csv(f"{out_dir}/{sheet_name}.tsv", sep='\t', index=False, chunksize=CHUNK_SIZE)
+
 
 def convert_xlsx_to_tsv(input_file: str,
                         out_dir: str,
-                        sheet_selection: str):
+                        sheet_selection: str,
+                        output_format: str = "tsv",
+                        infer_types: bool = False):
     """
     Convert .xlsx file to .tsv format.
     When "sheet_names" is not specified, convert all sheets to single TSV files.
+    The workbook, including its shared strings and styles, is parsed once
+    for all selected sheets.
 
     Parameters
     ----------
@@ -18,23 +142,231 @@ def convert_xlsx_to_tsv(input_file: str,
     Path to the output dir where the TSV will be saved
     sheet_names: str
     Comma-separated list of sheet names to convert.
+    output_format: str
+    One of OUTPUT_FORMATS
+    infer_types: bool
+    Assign explicit dtypes before writing TSV files
 
     Returns
     -------
     TSV file with the content of the .xlsx sheets
     """
     try:
-        # Read the specified sheet or, if None, all the sheets
-        data = pd.read_excel(input_file, sheet_name=sheet_selection)
-        if sheet_selection is not None:
-            # Create a single TSV files
-            data.to_csv(f"{out_dir}/{sheet_selection}.tsv", sep='\t', index=False)
-            print(f"Extracted sheet '{sheet_selection}' from {input_file}")
+        with pd.ExcelFile(input_file) as excel:
+            for sheet_name in parse_sheet_selection(sheet_selection, excel.sheet_names):
+                # Create one TSV file per sheet
+                write_sheet(excel.parse(sheet_name), out_dir, sheet_name, output_format, infer_types)
+                print(f"Extracted sheet '{sheet_name}' from {input_file}")
+    except Exception as e:
+        print(f"Failed to convert to TSV from {input_file}: {e}")
+
+
+def header_names(row):
+    """
+    Get the column names of a header row as pandas creates them: empty cells
+    are named 'Unnamed: <index>' and repeated names get the suffix .1, .2, ...
+
+    Parameters
+    ----------
+    row: tuple
+    Cell values of the header row, None for empty cells
+
+    Returns
+    -------
+    List of column names
+    """
+    names = [f"Unnamed: {index}" if value is None else str(value) for index, value in enumerate(row)]
+    unnamed = [index for index, value in enumerate(row) if value is None]
+    # given names are kept and the unnamed columns are mangled first
+    order = [index for index, value in enumerate(row) if value is not None] + unnamed
+    counts = {}
+    for index in order:
+        name = names[index]
+        count = counts.get(name, 0)
+        if count > 0:
+            new_name = name
+            while count > 0:
+                counts[name] = count + 1
+                new_name = f"{name}.{count}"
+                if new_name in names:
+                    count += 1
+                else:
+                    count = counts.get(new_name, 0)
+            names[index] = new_name
+            name = new_name
+        counts[name] = count + 1
+    return names
+
+
+def write_rows(rows, out_file: str):
+    """
+    Write rows of cell values to a TSV file, one row at a time.
+    The first row is the header and its column names are created like in
+    convert_xlsx_to_tsv. Empty rows at the end of the sheet are skipped.
+    The cell values are written as they are, i.e. unlike convert_xlsx_to_tsv
+    whole numbers, dates and booleans are not formatted by the type of their
+    column (see the help of the tool).
+
+    Parameters
+    ----------
+    rows: iterable
+    Tuples of cell values, None for empty cells
+    out_file: str
+    Path of the TSV file
+    """
+    with open(out_file, "w", newline="") as handle:
+        writer = csv.writer(handle, delimiter="\t", lineterminator="\n")
+        rows = iter(rows)
+        header = next(rows, None)
+        if header is None:
+            # like pandas for an empty sheet
+            handle.write("\n")
+            return
+        writer.writerow(header_names(header))
+        empty_rows = []
+        for row in rows:
+            if all(value is None for value in row):
+                empty_rows.append(row)
+                continue
+            if empty_rows:
+                writer.writerows(empty_rows)
+                empty_rows = []
+            writer.writerow(row)
+
+
+def convert_xlsx_to_tsv_streaming(input_file: str,
+                                  out_dir: str,
+                                  sheet_selection: str):
+    """
+    Convert .xlsx file to .tsv format without loading whole sheets into memory.
+    The workbook is opened read-only and the rows are written as they are read.
+    Old .xls files are converted with convert_xlsx_to_tsv.
+
+    Parameters
+    ----------
+    input_file: str
+    Path to the input .xlsx file
+    out_dir: str
+    Path to the output dir where the TSV will be saved
+    sheet_selection: str
+    Comma-separated list of sheet names to convert, all sheets if None
+
+    Returns
+    -------
+    TSV file with the content of the .xlsx sheets
+    """
+    if not zipfile.is_zipfile(input_file):
+        convert_xlsx_to_tsv(input_file, out_dir, sheet_selection)
+        return
+    try:
+        workbook = openpyxl.load_workbook(input_file, read_only=True, data_only=True)
+        try:
+            for sheet_name in parse_sheet_selection(sheet_selection, workbook.sheetnames):
+                write_rows(workbook[sheet_name].iter_rows(values_only=True), f"{out_dir}/{sheet_name}.tsv")
+                print(f"Extracted sheet '{sheet_name}' from {input_file}")
+        finally:
+            workbook.close()
+    except Exception as e:
+        print(f"Failed to convert to TSV from {input_file}: {e}")
+
+
+def sheet_sizes(input_file: str):
+    """
+    Get the sheet names of a workbook with the uncompressed size of their XML
+    part as an estimate of the conversion work, without parsing the sheets.
+
+    Parameters
+    ----------
+    input_file: str
+    Path to the input .xlsx/.xls file
+
+    Returns
+    -------
+    Dict of sheet name to size in bytes (0 for .xls files), in workbook order
+    """
+    if not zipfile.is_zipfile(input_file):
+        with pd.ExcelFile(input_file) as excel:
+            return {sheet_name: 0 for sheet_name in excel.sheet_names}
+    with zipfile.ZipFile(input_file) as archive:
+        workbook = ET.fromstring(archive.read("xl/workbook.xml"))
+        relations = ET.fromstring(archive.read("xl/_rels/workbook.xml.rels"))
+        targets = {}
+        for relation in relations.iterfind("rel:Relationship", XLSX_NS):
+            target = relation.attrib["Target"]
+            if target.startswith("/"):
+                targets[relation.attrib["Id"]] = target[1:]
+            else:
+                targets[relation.attrib["Id"]] = posixpath.normpath(posixpath.join("xl", target))
+        sizes = {}
+        for sheet in workbook.iterfind("main:sheets/main:sheet", XLSX_NS):
+            try:
+                sizes[sheet.attrib["name"]] = archive.getinfo(targets[sheet.attrib[XLSX_REL_ID]]).file_size
+            except KeyError:
+                sizes[sheet.attrib["name"]] = 0
+    return sizes
+
+
+def _init_worker(input_file: str, streaming: bool):
+    global _worker_workbook
+    if streaming and zipfile.is_zipfile(input_file):
+        _worker_workbook = openpyxl.load_workbook(input_file, read_only=True, data_only=True)
+    else:
+        _worker_workbook = pd.ExcelFile(input_file)
+
+
+def _convert_sheet(sheet_name: str, out_dir: str, output_format: str, infer_types: bool):
+    try:
+        if isinstance(_worker_workbook, pd.ExcelFile):
+            write_sheet(_worker_workbook.parse(sheet_name), out_dir, sheet_name, output_format, infer_types)
         else:
-            for sheet_page, df in data.items():
-                # Create several TSV files
-                df.to_csv(f"{out_dir}/{sheet_page}.tsv", sep='\t', index=False)
-                print(f"Extracted sheet '{sheet_page}' from {input_file}")
+            write_rows(_worker_workbook[sheet_name].iter_rows(values_only=True), f"{out_dir}/{sheet_name}.tsv")
+    except Exception as e:
+        return sheet_name, str(e)
+    return sheet_name, None
+
+
+def convert_xlsx_to_tsv_parallel(input_file: str,
+                                 out_dir: str,
+                                 sheet_selection: str,
+                                 workers: int,
+                                 streaming: bool = False,
+                                 output_format: str = "tsv",
+                                 infer_types: bool = False):
+    """
+    Convert sheets of an .xlsx file to .tsv format with several processes.
+    Every worker opens the workbook once and takes sheets from a shared queue,
+    largest sheets first, so that the work is balanced.
+
+    Parameters
+    ----------
+    input_file: str
+    Path to the input .xlsx file
+    out_dir: str
+    Path to the output dir where the TSV will be saved
+    sheet_selection: str
+    Comma-separated list of sheet names to convert, all sheets if None
+    workers: int
+    Number of worker processes
+    streaming: bool
+    Read the sheets row by row (see convert_xlsx_to_tsv_streaming)
+    output_format: str
+    One of OUTPUT_FORMATS, only TSV in streaming mode
+    infer_types: bool
+    Assign explicit dtypes before writing TSV files (not in streaming mode)
+
+    Returns
+    -------
+    TSV files with the content of the .xlsx sheets
+    """
+    try:
+        sizes = sheet_sizes(input_file)
+        sheet_names = sorted(parse_sheet_selection(sheet_selection, list(sizes)), key=sizes.get, reverse=True)
+        with multiprocessing.Pool(min(workers, len(sheet_names)) or 1, _init_worker, (input_file, streaming)) as pool:
+            for sheet_name, error in pool.imap_unordered(functools.partial(_convert_sheet, out_dir=out_dir, output_format=output_format, infer_types=infer_types), sheet_names):
+                if error is None:
+                    print(f"Extracted sheet '{sheet_name}' from {input_file}")
+                else:
+                    print(f"Failed to convert sheet '{sheet_name}' to TSV from {input_file}: {error}")
     except Exception as e:
         print(f"Failed to convert to TSV from {input_file}: {e}")
 
@@ -44,10 +376,21 @@ def main():
     parser.add_argument("--input-file", type=str, required=True, help="Path to the input .xlsx file.")
     parser.add_argument("--sheet_selection", type=str, required=False, default=None, help="Comma-separated list of sheet names to convert.")
     parser.add_argument('--out_dir', required=True, help="Output path where to create the .TSV files")
+    parser.add_argument('--streaming', action='store_true', help="Read the sheets row by row to keep the memory usage low.")
+    parser.add_argument('--workers', type=int, default=1, help="Number of processes converting sheets in parallel.")
+    parser.add_argument('--output_format', choices=OUTPUT_FORMATS, default="tsv", help="Format of the output files, Parquet and Feather need pyarrow.")
+    parser.add_argument('--infer_dtypes', action='store_true', help="Detect integer, float, date and categorical columns before writing TSV files.")
     args = parser.parse_args()
+    if args.streaming and (args.output_format != "tsv" or args.infer_dtypes):
+        parser.error("--streaming only supports TSV output without --infer_dtypes")
 
     # Call the conversion function with the provided arguments
-    convert_xlsx_to_tsv(args.input_file, args.out_dir, args.sheet_selection)
+    if args.workers > 1:
+        convert_xlsx_to_tsv_parallel(args.input_file, args.out_dir, args.sheet_selection, args.workers, args.streaming, args.output_format, args.infer_dtypes)
+    elif args.streaming:
+        convert_xlsx_to_tsv_streaming(args.input_file, args.out_dir, args.sheet_selection)
+    else:
+        convert_xlsx_to_tsv(args.input_file, args.out_dir, args.sheet_selection, args.output_format, args.infer_dtypes)
 
 
 if __name__ == "__main__":